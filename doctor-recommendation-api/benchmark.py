@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn
+from scipy import sparse
+from sklearn.preprocessing import LabelEncoder
+
+from flat_forest import export_model
+from optimized_train_model import assemble_forest, fit_bootstrap_tree
+from packed_dataset import PackedDataset, convert_csv
+
+# Synthetic data keeps the real dataset's width (~377 binary symptoms, ~773 diseases, a few symptoms per case).
+# Rows and trees are scaled down: sklearn stores a distribution over every disease at every node,
+# so even this small forest pickles to a few hundred MB.
+DEFAULT_CONFIG = {
+    "symptoms": 377,
+    "diseases": 773,
+    "departments": 20,
+    "doctors": 230,
+    "rows": 5000,
+    "trees": 20,
+    "seed": 0,
+}
+
+# Metrics compared against a baseline; all of them are better when lower
+COMPARED_METRICS = ("p50_us", "seconds", "peak_rss_mb", "seconds_per_tree")
+
+
+def build_fixtures(directory, config):
+    # Write everything load_model reads (model, encoder, columns, symptom index, both Excel sheets and the flat
+    # export) plus a packed dataset, all generated from a seeded RNG so runs are comparable
+    rng = np.random.RandomState(config["seed"])
+    os.makedirs(directory, exist_ok=True)
+    columns = [f"symptom {idx} {['pain', 'swelling', 'rash', 'fever', 'cough'][idx % 5]}" for idx in range(config["symptoms"])]
+    diseases = [f"disease {idx}" for idx in range(config["diseases"])]
+    le = LabelEncoder().fit(diseases)
+
+    # Each disease has a profile of 3-6 symptoms; a case shows most of its profile plus a little noise
+    profiles = [rng.choice(config["symptoms"], rng.randint(3, 7), replace=False) for _ in diseases]
+    y = rng.randint(0, config["diseases"], config["rows"])
+    X = (rng.rand(config["rows"], config["symptoms"]) < 0.01).astype(np.uint8)
+    for row, label in enumerate(y):
+        profile = profiles[label]
+        X[row, profile[rng.rand(len(profile)) < 0.8]] = 1
+
+    csv_path = os.path.join(directory, "Disease and symptoms dataset.csv")
+    frame = pd.DataFrame(X, columns=columns)
+    frame.insert(0, "diseases", np.asarray(diseases)[y])
+    frame.to_csv(csv_path, index=False)
+    dataset = convert_csv(csv_path, os.path.join(directory, "symptom_dataset"))
+    labels = np.asarray(dataset.labels)
+
+    # Trees are fit exactly like optimized_train_model.py --mode memmap
+    class_rows = np.unique(labels, return_index=True)[1]
+    estimators = [fit_bootstrap_tree(dataset.bits, labels, dataset.n_features, class_rows, tree_idx, dataset.n_rows)
+                  for tree_idx in range(config["trees"])]
+    model = assemble_forest(estimators, dataset.n_features, len(dataset.classes))
+
+    model_path = os.path.join(directory, "optimized_rf_model.pkl")
+    with open(model_path, "wb") as f:
+        pickle.dump(model, f)
+    with open(os.path.join(directory, "label_encoder.pkl"), "wb") as f:
+        pickle.dump(dataset.label_encoder(), f)
+    with open(os.path.join(directory, "symptom_columns.pkl"), "wb") as f:
+        pickle.dump(list(dataset.columns), f)
+    sparse.save_npz(os.path.join(directory, "symptom_disease_index.npz"),
+                    sparse.csr_matrix(dataset.class_symptom_counts().T.astype(np.int32)))
+    export_model(model_path, os.path.join(directory, "optimized_rf_model.flat"))
+
+    departments = [f"Department {idx}" for idx in range(config["departments"])] + ["Medicine"]
+    pd.DataFrame({
+        "Diseases": le.classes_,
+        "Department": rng.choice(departments, len(le.classes_)),
+    }).to_excel(os.path.join(directory, "Mapped_Diseases_Final2.xlsx"), index=False)
+    pd.DataFrame({
+        "Name": [f"Dr. Doctor {idx}" for idx in range(config["doctors"])],
+        "Designation": rng.choice(["Prof.", "Assoc. Prof.", "Asst. Prof."], config["doctors"]),
+        "Department": rng.choice(departments, config["doctors"]),
+    }).to_excel(os.path.join(directory, "Faculty_Cleaned_ML.xlsx"), index=False)
+
+    with open(os.path.join(directory, "fixtures.json"), "w") as f:
+        json.dump({"config": config}, f, indent=2)
+
+
+def ensure_fixtures(directory, config):
+    manifest_path = os.path.join(directory, "fixtures.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f)["config"] == config:
+                return
+    print(f"Building synthetic fixtures in {directory}...")
+    run_isolated(build_fixtures, directory, config)
+
+
+def sample_inputs(columns, count, seed):
+    # Comma-separated symptom strings of 1-5 known symptoms, the shape /recommend receives
+    rng = np.random.RandomState(seed)
+    return [", ".join(rng.choice(columns, rng.randint(1, 6), replace=False)) for _ in range(count)]
+
+
+def time_calls(fn, inputs, repeat):
+    # Per-call latency over every input, repeated; the first pass warms caches and is discarded
+    for value in inputs:
+        fn(value)
+    samples = []
+    for _ in range(repeat):
+        for value in inputs:
+            start = time.perf_counter_ns()
+            fn(value)
+            samples.append(time.perf_counter_ns() - start)
+    samples = np.asarray(samples) / 1000
+    return {
+        "calls": int(len(samples)),
+        "mean_us": round(float(samples.mean()), 2),
+        "p50_us": round(float(np.percentile(samples, 50)), 2),
+        "p95_us": round(float(np.percentile(samples, 95)), 2),
+    }
+
+
+def peak_rss_mb():
+    # On Linux VmHWM is this program's own peak; ru_maxrss also counts the parent's pages at fork time
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def configure_process(data_dir, artifact):
+    # Runs in a fresh process before main is imported, since main reads its settings at import time
+    os.environ["DATA_DIR"] = data_dir
+    os.environ["MODEL_ARTIFACT"] = "auto" if artifact else "off"
+    os.environ["PREDICTION_CACHE_SIZE"] = "0"
+    logging.disable(logging.INFO)
+
+
+def measure_training(data_dir, n_trees):
+    # Bootstrap trees fit on the packed fixture dataset, as one worker of the memmap training mode does
+    dataset = PackedDataset(os.path.join(data_dir, "symptom_dataset"))
+    labels = np.asarray(dataset.labels)
+    class_rows = np.unique(labels, return_index=True)[1]
+    start_time = time.perf_counter()
+    for tree_idx in range(n_trees):
+        fit_bootstrap_tree(dataset.bits, labels, dataset.n_features, class_rows, tree_idx, dataset.n_rows)
+    return {"seconds_per_tree": round((time.perf_counter() - start_time) / n_trees, 4), "peak_rss_mb": peak_rss_mb()}
+
+
+def measure_startup(data_dir, artifact):
+    configure_process(data_dir, artifact)
+    import main
+    start_time = time.perf_counter()
+    asyncio.run(main.load_model())
+    return {"seconds": round(time.perf_counter() - start_time, 4), "peak_rss_mb": peak_rss_mb()}
+
+
+def measure_hot_paths(data_dir, repeat, n_inputs):
+    configure_process(data_dir, artifact=False)
+    import main
+    asyncio.run(main.load_model())
+
+    generation = main.model_generation
+    # The API releases the sklearn model once the flat forest is verified, so the reference is unpickled separately
+    with open(os.path.join(data_dir, "optimized_rf_model.pkl"), "rb") as f:
+        model = pickle.load(f)
+    inputs = sample_inputs(list(generation.symptom_columns), n_inputs, seed=1)
+    vectors = []
+    for symptoms in inputs:
+        _, active_indices, _ = main.vectorize_symptoms(generation, symptoms)
+        vector = np.zeros(generation.symptom_matcher.vector_length)
+        vector[list(active_indices)] = 1
+        vectors.append(vector)
+    encoded = [int(np.argmax(generation.flat_forest.predict_proba(vector)[0])) for vector in vectors]
+    diseases = list(generation.le.inverse_transform(encoded))
+
+    results = {
+        "vectorize": time_calls(lambda symptoms: main.vectorize_symptoms(generation, symptoms), inputs, repeat),
+        "forest_predict_flat": time_calls(generation.flat_forest.predict_proba, vectors, repeat),
+        "forest_predict_flat_early_exit": time_calls(generation.flat_forest.predict_proba_early_exit, vectors, repeat),
+        "forest_predict_sklearn": time_calls(lambda vector: model.predict_proba([vector]), vectors, max(1, repeat // 5)),
+        "label_decode": time_calls(lambda code: generation.le.inverse_transform([code]), encoded, repeat),
+        "doctor_lookup": time_calls(main.get_doctors_by_disease, diseases, repeat),
+        "recommend": time_calls(main.recommend_for_symptoms, inputs, repeat),
+    }
+
+    # Whole batches, reported per case
+    batch = time_calls(main.recommend_for_symptoms_batch, [inputs], repeat)
+    results["recommend_batch_per_case"] = {key: round(value / len(inputs), 2) if key.endswith("_us") else value
+                                           for key, value in batch.items()}
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def run_isolated(fn, *args):
+    # Each measurement gets its own interpreter so startup time and peak RSS aren't skewed by earlier work
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    # Returns (metric, baseline, current, ratio) for every compared metric that got slower beyond tolerance
+    current, previous = flatten(results), flatten(baseline)
+    regressions = []
+    print(f"\n{'metric':<55} {'baseline':>12} {'current':>12} {'change':>8}")
+    for metric in sorted(current):
+        if not metric.endswith(COMPARED_METRICS) or metric not in previous or previous[metric] <= 0:
+            continue
+        ratio = current[metric] / previous[metric]
+        flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{metric:<55} {previous[metric]:>12} {current[metric]:>12} {ratio - 1:>+8.1%}{flag}")
+        if flag:
+            regressions.append((metric, previous[metric], current[metric], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API's hot paths on synthetic fixtures")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the results JSON")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline before a metric counts as a regression")
+    parser.add_argument("--fixtures", default=os.path.join(tempfile.gettempdir(), "doctor-api-benchmark"),
+                        help="Fixture directory, reused while its configuration is unchanged")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the sample inputs per measurement")
+    parser.add_argument("--inputs", type=int, default=200, help="Distinct symptom inputs per measurement")
+    parser.add_argument("--training-trees", type=int, default=3, help="Trees fit for the training measurement")
+    for key, value in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{key}", type=int, default=value)
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in DEFAULT_CONFIG}
+    ensure_fixtures(args.fixtures, config)
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scikit-learn": sklearn.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {**config, "repeat": args.repeat, "inputs": args.inputs, "training_trees": args.training_trees},
+        "training": run_isolated(measure_training, args.fixtures, args.training_trees),
+        "startup": {
+            "flat_artifact": run_isolated(measure_startup, args.fixtures, True),
+            "pickle": run_isolated(measure_startup, args.fixtures, False),
+        },
+        "latency": run_isolated(measure_hot_paths, args.fixtures, args.repeat, args.inputs),
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("Warning: the baseline was recorded with a different configuration")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+from scipy import sparse
+
+from flat_forest import FlatForest, source_signature, verify_parity
+from packed_dataset import PackedDataset
+
+# Rows scored per predict_proba call while evaluating
+EVAL_CHUNK_ROWS = 2000
+# Largest probability difference a lossless artifact may show against the pickle; leaves are stored as float32,
+# which is accurate to about 1e-7 per tree
+PARITY_TOLERANCE = 1e-6
+
+
+class LeafTable:
+    # Distinct sparse leaf distributions shared by every tree. Trees grown to purity mostly end in
+    # one-class leaves, so the whole forest needs little more than one leaf per class.
+    def __init__(self, top_k=0, min_prob=0.0):
+        self.top_k = top_k
+        self.min_prob = min_prob
+        self.slots = {}
+        self.classes = []
+        self.probs = []
+        self.top_class = []
+
+    def sparsify(self, distribution):
+        # Keep the top_k most likely classes (0 keeps all) at or above min_prob, always keeping the
+        # most likely one, renormalized and rounded to float32 so equal leaves compare equal
+        classes = np.flatnonzero(distribution)
+        if len(classes) == 0:
+            classes = np.arange(len(distribution))
+        order = np.argsort(-distribution[classes], kind="stable")
+        classes = classes[order]
+        if self.top_k > 0:
+            classes = classes[:self.top_k]
+        classes = classes[(distribution[classes] >= self.min_prob) | (np.arange(len(classes)) == 0)]
+        probs = distribution[classes] / distribution[classes].sum()
+        order = np.argsort(classes)
+        return tuple(int(c) for c in classes[order]), tuple(float(p) for p in probs[order].astype(np.float32))
+
+    def slot(self, key):
+        if key not in self.slots:
+            self.slots[key] = len(self.classes)
+            self.classes.append(key[0])
+            self.probs.append(key[1])
+            self.top_class.append(key[0][int(np.argmax(key[1]))])
+        return self.slots[key]
+
+    def to_csr(self, n_classes):
+        indptr = np.zeros(len(self.classes) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(classes) for classes in self.classes])
+        indices = np.fromiter((c for classes in self.classes for c in classes), dtype=np.int32, count=indptr[-1])
+        data = np.fromiter((p for probs in self.probs for p in probs), dtype=np.float32, count=indptr[-1])
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(self.classes), n_classes))
+
+
+class TreeCompactor:
+    # Rewrites one fitted sklearn tree as bit tests over binary features:
+    # - splits whose threshold sends both 0 and 1 the same way are skipped
+    # - a feature already tested higher up the path is not tested again, only the reachable branch is kept
+    # - sibling leaves with the same (sparse) distribution are merged into one leaf, and with
+    #   merge_same_class also siblings that predict the same class (taking their parent's distribution)
+    def __init__(self, tree, n_features, leaf_table, merge_same_class=False):
+        self.leaf_table = leaf_table
+        self.merge_same_class = merge_same_class
+        self.is_leaf = tree.children_left == -1
+        self.feature = tree.feature
+        self.clear_child = np.where(0 <= tree.threshold, tree.children_left, tree.children_right)
+        self.set_child = np.where(1 <= tree.threshold, tree.children_left, tree.children_right)
+        values = tree.value[:, 0, :].astype(np.float64)
+        normalizer = values.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        self.values = values / normalizer
+        self.known = np.full(n_features, -1, dtype=np.int8)
+        self.nodes = []
+        self.stats = {"redundant_splits": 0, "repeated_tests": 0, "merged_leaves": 0}
+
+    def emit(self, feature, clear, set_, slot):
+        self.nodes.append((feature, clear, set_, slot))
+        return len(self.nodes) - 1
+
+    def emit_leaf(self, key):
+        index = len(self.nodes)
+        return self.emit(0, index, index, self.leaf_table.slot(key))
+
+    def build(self, node):
+        # Returns ("leaf", key, 0) or ("node", index, depth) for the compacted subtree under node
+        if self.is_leaf[node]:
+            return "leaf", self.leaf_table.sparsify(self.values[node]), 0
+        feature = self.feature[node]
+        if self.clear_child[node] == self.set_child[node]:
+            self.stats["redundant_splits"] += 1
+            return self.build(self.clear_child[node])
+        if self.known[feature] >= 0:
+            self.stats["repeated_tests"] += 1
+            return self.build(self.set_child[node] if self.known[feature] else self.clear_child[node])
+
+        self.known[feature] = 0
+        clear = self.build(self.clear_child[node])
+        self.known[feature] = 1
+        set_ = self.build(self.set_child[node])
+        self.known[feature] = -1
+
+        if clear[0] == "leaf" and set_[0] == "leaf":
+            if clear[1] == set_[1]:
+                self.stats["merged_leaves"] += 1
+                return clear
+            if self.merge_same_class and self.leaf_top(clear[1]) == self.leaf_top(set_[1]):
+                self.stats["merged_leaves"] += 1
+                return "leaf", self.leaf_table.sparsify(self.values[node]), 0
+        clear_index = clear[1] if clear[0] == "node" else self.emit_leaf(clear[1])
+        set_index = set_[1] if set_[0] == "node" else self.emit_leaf(set_[1])
+        return "node", self.emit(feature, clear_index, set_index, -1), 1 + max(clear[2], set_[2])
+
+    @staticmethod
+    def leaf_top(key):
+        return key[0][int(np.argmax(key[1]))]
+
+    def compact(self):
+        # (feature, clear, set, leaf slot) per node with node indices local to the tree, root index, depth
+        kind, value, depth = self.build(0)
+        root = value if kind == "node" else self.emit_leaf(value)
+        return np.array(self.nodes, dtype=np.int64).reshape(-1, 4), root, depth
+
+
+def assemble(trees, tree_refs, leaf_values, classes, n_features):
+    # Pack the distinct compacted trees back to back into a FlatForest with the narrowest index types that fit.
+    # tree_refs holds one entry per forest tree; duplicates point their root at the same nodes, so every
+    # tree still votes and the forest mean is unchanged. Distinct trees no tree refers to are left out.
+    used = sorted(set(tree_refs))
+    total_nodes = sum(len(trees[ref][0]) for ref in used)
+    feature = np.zeros(total_nodes, dtype=np.int16 if n_features < 2 ** 15 else np.int32)
+    children = np.zeros((total_nodes, 2), dtype=np.int32)
+    leaf_slot = np.zeros(total_nodes, dtype=np.int32)
+    tree_roots = {}
+    offset = 0
+    for ref in used:
+        nodes, root, _ = trees[ref]
+        node_slice = slice(offset, offset + len(nodes))
+        feature[node_slice] = nodes[:, 0]
+        children[node_slice] = offset + nodes[:, 1:3]
+        leaf_slot[node_slice] = nodes[:, 3]
+        tree_roots[ref] = offset + root
+        offset += len(nodes)
+    roots = np.array([tree_roots[ref] for ref in tree_refs], dtype=np.int32)
+    max_depth = max(trees[ref][2] for ref in used)
+    return FlatForest(feature, children.ravel(), leaf_slot, leaf_values, roots, max_depth, classes)
+
+
+def tree_signature(nodes, root):
+    return hashlib.sha1(nodes.tobytes() + np.int64(root).tobytes()).hexdigest()
+
+
+def compact_forest(model, top_k=0, min_prob=0.0, merge_same_class=False):
+    # Compact every tree and store exact duplicates once. Returns the distinct trees and, per forest tree,
+    # the index of its distinct tree
+    classes = np.asarray(model.classes_)
+    n_features = int(model.n_features_in_)
+    leaf_table = LeafTable(top_k, min_prob)
+    trees = []
+    tree_refs = []
+    seen = {}
+    stats = {"redundant_splits": 0, "repeated_tests": 0, "merged_leaves": 0,
+             "single_leaf_trees": 0, "shared_trees": 0}
+    # TreeCompactor.build recurses once per level
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * max(est.tree_.max_depth for est in model.estimators_) + 100))
+    for tree_idx, est in enumerate(model.estimators_):
+        tree = est.tree_
+        if tree.n_outputs != 1 or tree.value.shape[2] != len(classes):
+            raise ValueError(f"Tree {tree_idx} predicts {tree.value.shape[2]} classes but the forest has {len(classes)}")
+        compactor = TreeCompactor(tree, n_features, leaf_table, merge_same_class)
+        nodes, root, depth = compactor.compact()
+        for key, count in compactor.stats.items():
+            stats[key] += count
+
+        if len(nodes) == 1:
+            stats["single_leaf_trees"] += 1
+        signature = tree_signature(nodes, root)
+        if signature in seen:
+            stats["shared_trees"] += 1
+        else:
+            seen[signature] = len(trees)
+            trees.append((nodes, root, depth))
+        tree_refs.append(seen[signature])
+        print(f"\rCompacted tree {tree_idx + 1}/{len(model.estimators_)}", end="")
+        sys.stdout.flush()
+    print()
+    return trees, tree_refs, leaf_table, stats
+
+
+def predict_labels(predict_proba, classes, X):
+    labels = []
+    for start in range(0, X.shape[0], EVAL_CHUNK_ROWS):
+        labels.append(classes[predict_proba(X[start:start + EVAL_CHUNK_ROWS]).argmax(axis=1)])
+    return np.concatenate(labels)
+
+
+def per_tree_accuracy(forest, leaf_table, X, y):
+    # Accuracy of each tree's own top class on the evaluation rows
+    top_class = np.asarray(forest.classes_)[np.asarray(leaf_table.top_class)]
+    correct = np.zeros(forest.n_trees, dtype=np.int64)
+    for start in range(0, X.shape[0], EVAL_CHUNK_ROWS):
+        slots = forest.apply(X[start:start + EVAL_CHUNK_ROWS])
+        correct += (top_class[slots] == y[start:start + EVAL_CHUNK_ROWS, None]).sum(axis=0)
+    return correct / max(1, X.shape[0])
+
+
+def dense_bytes(model):
+    # Size of the plain flat forest export: int32 node arrays, a bool leaf mask and dense float64 leaves
+    n_nodes = sum(est.tree_.node_count for est in model.estimators_)
+    n_leaves = sum(int((est.tree_.children_left == -1).sum()) for est in model.estimators_)
+    return n_nodes * (4 + 8 + 4 + 1) + len(model.estimators_) * 4 + n_leaves * len(model.classes_) * 8
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def main():
+    data_dir = os.environ.get("DATA_DIR", "./data")
+    parser = argparse.ArgumentParser(description="Compact a trained forest into a smaller flat artifact")
+    parser.add_argument("model", nargs="?", default=os.path.join(data_dir, "optimized_rf_model.pkl"))
+    parser.add_argument("--output", default=None,
+                        help="Artifact directory to write (default: data/optimized_rf_model.flat, which the API serves, "
+                             "or data/optimized_rf_model.lossy.flat with any of the lossy options below)")
+    parser.add_argument("--report", default=os.path.join(data_dir, "compaction_report.json"))
+    parser.add_argument("--dataset", default=os.path.join(data_dir, "symptom_dataset"),
+                        help="Packed dataset prefix used for the accuracy report")
+    parser.add_argument("--eval-rows", type=int, default=20000, help="Dataset rows sampled for the report (0 skips it)")
+    parser.add_argument("--top-k", type=int, default=0, help="Classes kept per leaf, most likely first (0 keeps all)")
+    parser.add_argument("--min-prob", type=float, default=0.0, help="Drop leaf classes below this probability")
+    parser.add_argument("--merge-same-class", action="store_true",
+                        help="Merge sibling leaves that predict the same class")
+    parser.add_argument("--min-tree-accuracy", type=float, default=0.0,
+                        help="Drop trees whose own accuracy on the evaluation rows is below this")
+    parser.add_argument("--verify-samples", type=int, default=32,
+                        help="Random symptom vectors a lossless artifact is checked on against the pickle before saving (at least 1)")
+    args = parser.parse_args()
+    if args.verify_samples < 1:
+        parser.error("--verify-samples must be at least 1")
+    lossy = args.top_k > 0 or args.min_prob > 0 or args.merge_same_class or args.min_tree_accuracy > 0
+    if args.output is None:
+        args.output = os.path.join(data_dir, "optimized_rf_model.lossy.flat" if lossy else "optimized_rf_model.flat")
+
+    start_time = time.time()
+    with open(args.model, "rb") as f:
+        model = pickle.load(f)
+    pickle_load_seconds = time.time() - start_time
+    classes = np.asarray(model.classes_)
+    n_features = int(model.n_features_in_)
+    print(f"Loaded {len(model.estimators_)} trees from {args.model} in {pickle_load_seconds:.2f}s")
+
+    trees, tree_refs, leaf_table, stats = compact_forest(model, args.top_k, args.min_prob, args.merge_same_class)
+    leaf_values = leaf_table.to_csr(len(classes))
+    forest = assemble(trees, tree_refs, leaf_values, classes, n_features)
+
+    X = y = None
+    if args.eval_rows > 0 and os.path.exists(args.dataset + ".json"):
+        dataset = PackedDataset(args.dataset)
+        rng = np.random.RandomState(0)
+        rows = np.sort(rng.choice(dataset.n_rows, min(args.eval_rows, dataset.n_rows), replace=False))
+        X, y = dataset.rows(rows), np.asarray(dataset.labels[rows])
+    elif args.eval_rows > 0:
+        print(f"Packed dataset {args.dataset} not found, skipping the accuracy report")
+
+    stats["weak_trees"] = 0
+    if X is not None and args.min_tree_accuracy > 0:
+        accuracy = per_tree_accuracy(forest, leaf_table, X, y)
+        keep = accuracy >= args.min_tree_accuracy
+        stats["weak_trees"] = int((~keep).sum())
+        if not keep.any():
+            raise ValueError(f"No tree reaches --min-tree-accuracy {args.min_tree_accuracy}")
+        tree_refs = [ref for ref, kept in zip(tree_refs, keep) if kept]
+        forest = assemble(trees, tree_refs, leaf_values, classes, n_features)
+
+    # Nothing is written unless a lossless artifact really predicts like the pickle, since the API serves it unchecked
+    if not lossy:
+        max_diff, mismatches = verify_parity(forest, model, n_features, n_samples=args.verify_samples)
+        if max_diff > PARITY_TOLERANCE or mismatches:
+            raise ValueError(f"Compacted forest parity check failed (max diff {max_diff}, {mismatches} mismatched "
+                             f"predictions), {args.output} was not written")
+        print(f"Parity check passed on {args.verify_samples} vectors (max diff {max_diff:.2e})")
+
+    # The API refuses lossy artifacts unless MODEL_ARTIFACT=lossy, since they are not checked against the pickle
+    settings = {"top_k": args.top_k, "min_prob": args.min_prob, "merge_same_class": args.merge_same_class,
+                "min_tree_accuracy": args.min_tree_accuracy, "lossy": lossy}
+    forest.save(args.output, {"n_features": n_features, "source": source_signature(args.model),
+                              "compaction": settings})
+
+    start_time = time.time()
+    FlatForest.load(args.output, mmap_mode=None)
+    artifact_load_seconds = time.time() - start_time
+
+    report = {
+        "settings": settings,
+        "original": {
+            "trees": len(model.estimators_),
+            "nodes": int(sum(est.tree_.node_count for est in model.estimators_)),
+            "pickle_bytes": os.path.getsize(args.model),
+            "flat_bytes": dense_bytes(model),
+            "load_seconds": round(pickle_load_seconds, 3),
+        },
+        "compacted": {
+            "trees": forest.n_trees,
+            "distinct_trees": len(set(tree_refs)),
+            "nodes": len(forest.feature),
+            "distinct_leaves": forest.n_leaves,
+            "leaf_entries": int(leaf_values.nnz),
+            "memory_bytes": forest.nbytes,
+            "artifact_bytes": directory_bytes(args.output),
+            "load_seconds": round(artifact_load_seconds, 3),
+        },
+        "removed": stats,
+    }
+    report["size_reduction"] = round(report["original"]["flat_bytes"] / max(1, forest.nbytes), 1)
+
+    if X is not None:
+        original_labels = predict_labels(model.predict_proba, classes, X)
+        compacted_labels = predict_labels(forest.predict_proba, classes, X)
+        report["evaluation"] = {
+            # Rows come from the training data, so accuracies are in-sample; agreement is the useful number
+            "rows": int(len(y)),
+            "original_accuracy": round(float((original_labels == y).mean()), 4),
+            "compacted_accuracy": round(float((compacted_labels == y).mean()), 4),
+            "agreement": round(float((original_labels == compacted_labels).mean()), 4),
+        }
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Compacted artifact written to {args.output}, report to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import json
+import os
+import pickle
+import shutil
+import sys
+
+import numpy as np
+from scipy import sparse
+
+# Upper bound on the (rows x trees x classes) leaf-value block gathered at once by predict_proba
+GATHER_BUDGET = 1 << 22
+
+# Leaves converted from a tree's dense values at once when compiling
+LEAF_CONVERT_ROWS = 1024
+
+# Bumped whenever the on-disk layout written by FlatForest.save changes; version 1 (dense leaves only) is still readable
+ARTIFACT_FORMAT_VERSION = 2
+SUPPORTED_FORMAT_VERSIONS = (1, 2)
+ARTIFACT_ARRAYS = ("feature", "children", "leaf_slot", "is_leaf", "roots", "classes")
+# Leaf distributions are one dense (leaves x classes) array, or CSR parts when stored sparsely
+DENSE_LEAF_ARRAYS = ("leaf_values",)
+SPARSE_LEAF_ARRAYS = ("leaf_indptr", "leaf_classes", "leaf_probs")
+
+
+class FlatForest:
+    # A RandomForestClassifier compiled into contiguous arrays shared by every tree.
+    # Nodes of all trees are packed back to back; leaves point to themselves so a fixed
+    # number of steps walks every tree at once. Inputs are binary symptom flags, so each
+    # split is precomputed as a bit test: the next node when the feature is 0 or 1.
+    # children holds interleaved [if_clear, if_set] pairs so one gather at 2 * node + bit finds the next node.
+    # leaf_values is a dense (leaves x classes) array or a scipy CSR matrix of the same shape.
+    def __init__(self, feature, children, leaf_slot, leaf_values, roots, max_depth, classes, is_leaf=None):
+        self.feature = feature
+        self.children = children
+        self.leaf_slot = leaf_slot
+        self.leaf_values = leaf_values
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = classes
+        self.is_leaf = leaf_slot >= 0 if is_leaf is None else is_leaf
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_classes(self):
+        return self.leaf_values.shape[1]
+
+    @property
+    def n_leaves(self):
+        return self.leaf_values.shape[0]
+
+    @property
+    def sparse_leaves(self):
+        return sparse.issparse(self.leaf_values)
+
+    @property
+    def nbytes(self):
+        arrays = [self.feature, self.children, self.leaf_slot, self.is_leaf, self.roots]
+        if self.sparse_leaves:
+            arrays += [self.leaf_values.indptr, self.leaf_values.indices, self.leaf_values.data]
+        else:
+            arrays.append(self.leaf_values)
+        return int(sum(array.nbytes for array in arrays))
+
+    @classmethod
+    def from_estimators(cls, model):
+        classes = np.asarray(model.classes_)
+        n_classes = len(classes)
+        total_nodes = sum(est.tree_.node_count for est in model.estimators_)
+
+        feature = np.zeros(total_nodes, dtype=np.int32)
+        children = np.zeros((total_nodes, 2), dtype=np.int32)
+        leaf_slot = np.full(total_nodes, -1, dtype=np.int32)
+        roots = np.zeros(len(model.estimators_), dtype=np.int32)
+        leaf_blocks = []
+        max_depth = 0
+        offset = 0
+        n_leaves = 0
+
+        for tree_idx, est in enumerate(model.estimators_):
+            tree = est.tree_
+            if tree.n_outputs != 1 or tree.value.shape[2] != n_classes:
+                raise ValueError(
+                    f"Tree {tree_idx} predicts {tree.value.shape[2]} classes but the forest has {n_classes}"
+                )
+
+            n_nodes = tree.node_count
+            nodes = np.arange(n_nodes)
+            leaves = tree.children_left == -1
+            internal = ~leaves
+
+            # x <= threshold goes left; for a 0/1 feature that is a fixed outcome per bit value
+            threshold = tree.threshold
+            clear_goes_left = 0 <= threshold
+            set_goes_left = 1 <= threshold
+            clear_child = np.where(clear_goes_left, tree.children_left, tree.children_right)
+            set_child = np.where(set_goes_left, tree.children_left, tree.children_right)
+
+            node_slice = slice(offset, offset + n_nodes)
+            feature[node_slice] = np.where(internal, tree.feature, 0)
+            children[node_slice, 0] = offset + np.where(internal, clear_child, nodes)
+            children[node_slice, 1] = offset + np.where(internal, set_child, nodes)
+
+            # Normalize leaf counts the same way DecisionTreeClassifier.predict_proba does. Leaves are kept sparse:
+            # most are pure, so a dense (leaves x classes) copy would be almost all zeros yet as large as the
+            # model's own tree values. They are converted a slice of leaves at a time, so the temporary dense
+            # copies stay small too
+            leaf_nodes = nodes[leaves]
+            for start in range(0, len(leaf_nodes), LEAF_CONVERT_ROWS):
+                values = tree.value[leaf_nodes[start:start + LEAF_CONVERT_ROWS], 0, :].astype(np.float64)
+                normalizer = values.sum(axis=1, keepdims=True)
+                normalizer[normalizer == 0.0] = 1.0
+                leaf_blocks.append(sparse.csr_matrix(values / normalizer))
+
+            leaf_slot[offset + nodes[leaves]] = n_leaves + np.arange(leaves.sum(), dtype=np.int32)
+            roots[tree_idx] = offset
+            max_depth = max(max_depth, tree.max_depth)
+            n_leaves += int(leaves.sum())
+            offset += n_nodes
+
+        leaf_values = sparse.vstack(leaf_blocks, format="csr")
+        leaf_values.sort_indices()
+        return cls(feature, children.ravel(), leaf_slot, leaf_values, roots, max_depth, classes)
+
+    def save(self, directory, metadata=None):
+        # One .npy per array plus metadata.json, written to a sibling directory and swapped in at the end
+        parent = os.path.dirname(os.path.abspath(directory))
+        tmp_dir = os.path.join(parent, f".{os.path.basename(directory)}.tmp-{os.getpid()}")
+        old_dir = os.path.join(parent, f".{os.path.basename(directory)}.old-{os.getpid()}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        arrays = {name: getattr(self, name) for name in ARTIFACT_ARRAYS if name != "classes"}
+        arrays["classes"] = self.classes_
+        if self.sparse_leaves:
+            arrays.update(leaf_indptr=self.leaf_values.indptr, leaf_classes=self.leaf_values.indices,
+                          leaf_probs=self.leaf_values.data)
+        else:
+            arrays["leaf_values"] = self.leaf_values
+        for name, value in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(value))
+        with open(os.path.join(tmp_dir, "metadata.json"), "w") as f:
+            json.dump({
+                "format_version": ARTIFACT_FORMAT_VERSION,
+                "leaf_format": "sparse" if self.sparse_leaves else "dense",
+                "max_depth": int(self.max_depth),
+                "n_trees": int(self.n_trees),
+                "n_classes": int(self.n_classes),
+                **(metadata or {})
+            }, f, indent=2)
+
+        if os.path.exists(directory):
+            os.rename(directory, old_dir)
+        os.rename(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        # With mmap_mode="r" the arrays stay in the page cache, shared by every process mapping them
+        metadata = read_artifact_metadata(directory)
+        if metadata.get("format_version") not in SUPPORTED_FORMAT_VERSIONS:
+            raise ValueError(f"Unsupported flat forest format {metadata.get('format_version')} in {directory}")
+        sparse_leaves = metadata.get("leaf_format", "dense") == "sparse"
+        names = ARTIFACT_ARRAYS + (SPARSE_LEAF_ARRAYS if sparse_leaves else DENSE_LEAF_ARRAYS)
+        # Plain ndarray views of the maps: indexing an np.memmap subclass adds overhead to every gather
+        arrays = {name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False))
+                  for name in names}
+        if sparse_leaves:
+            leaf_values = sparse.csr_matrix((arrays["leaf_probs"], arrays["leaf_classes"], arrays["leaf_indptr"]),
+                                            shape=(len(arrays["leaf_indptr"]) - 1, metadata["n_classes"]), copy=False)
+        else:
+            leaf_values = arrays["leaf_values"]
+        forest = cls(arrays["feature"], arrays["children"], arrays["leaf_slot"], leaf_values,
+                     arrays["roots"], metadata["max_depth"], arrays["classes"], is_leaf=arrays["is_leaf"])
+        return forest, metadata
+
+    def apply(self, X):
+        # Leaf slot reached in every tree for every row, shape (n_rows, n_trees)
+        X = as_binary_matrix(X)
+        n_rows, n_features = X.shape
+        bits = X.ravel()
+        row_offsets = (np.arange(n_rows, dtype=np.int64) * n_features)[:, None]
+        nodes = np.broadcast_to(self.roots, (n_rows, self.n_trees)).astype(np.int64)
+        for depth in range(self.max_depth):
+            # Checking for all-leaves only occasionally keeps the common step down to three gathers
+            if depth % 8 == 7 and self.is_leaf[nodes].all():
+                break
+            nodes = self.children[2 * nodes + bits[row_offsets + self.feature[nodes]]]
+        return self.leaf_slot[nodes]
+
+    def sum_leaf_runs(self, slots, run_bounds):
+        # Dense sum of the leaf distributions in slots[run_bounds[i]:run_bounds[i + 1]] for every run i
+        if self.sparse_leaves:
+            # Gather every reached leaf's (class, probability) entries and add them up per run with one bincount
+            n_runs = len(run_bounds) - 1
+            indptr = self.leaf_values.indptr
+            starts = indptr[slots]
+            lengths = indptr[slots + 1] - starts
+            positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            entry_runs = np.repeat(np.repeat(np.arange(n_runs), np.diff(run_bounds)), lengths)
+            sums = np.bincount(entry_runs * self.n_classes + self.leaf_values.indices[positions],
+                               weights=self.leaf_values.data[positions], minlength=n_runs * self.n_classes)
+            return sums.reshape(n_runs, self.n_classes)
+        if len(run_bounds) == 2:
+            return np.asarray(self.leaf_values[slots].sum(axis=0), dtype=np.float64).reshape(1, -1)
+        # A sparse (runs x leaves) indicator sums every run in one product without gathering a dense block first
+        reached = sparse.csr_matrix((np.ones(len(slots)), slots, run_bounds), shape=(len(run_bounds) - 1, self.n_leaves))
+        sums = reached @ self.leaf_values
+        return sums.toarray() if sparse.issparse(sums) else sums
+
+    def predict_proba(self, X):
+        # Mean of the per-tree leaf distributions, matching RandomForestClassifier.predict_proba
+        slots = self.apply(X)
+        if self.sparse_leaves:
+            run_bounds = np.arange(0, slots.size + 1, self.n_trees)
+            return self.sum_leaf_runs(slots.ravel(), run_bounds) / self.n_trees
+        proba = np.empty((slots.shape[0], self.n_classes), dtype=np.float64)
+        chunk_rows = max(1, GATHER_BUDGET // (self.n_trees * self.n_classes))
+        for start in range(0, slots.shape[0], chunk_rows):
+            chunk = slots[start:start + chunk_rows]
+            proba[start:start + chunk_rows] = self.leaf_values[chunk].sum(axis=1)
+        proba /= self.n_trees
+        return proba
+
+    def predict_proba_early_exit(self, X, check_every=16, confidence=0.0, min_trees=None):
+        # Walk every tree at once like apply, but every check_every steps tally the votes of the trees that have
+        # reached a leaf and stop each row as soon as it is settled. Every tree adds at most 1 to any class,
+        # so once the leader is ahead by more than the trees still walking its argmax cannot change. Shallow
+        # paths finish first, so the long tail of deep paths is usually skipped. With confidence > 0 rows also
+        # stop once the leader's mean probability over the finished trees reaches it, but only after at least
+        # min_trees trees have voted (default: a quarter of the forest, at least 8): leaves are usually pure, so
+        # without a floor the first tree to finish would decide the row on its own.
+        # Returns the mean over the trees each row used, and the number of trees used per row.
+        X = as_binary_matrix(X)
+        n_rows, n_features = X.shape
+        bits = X.ravel()
+        if min_trees is None:
+            min_trees = max(8, self.n_trees // 4)
+        min_trees = min(max(1, min_trees), self.n_trees)
+        votes = np.zeros((n_rows, self.n_classes), dtype=np.float64)
+        trees_used = np.zeros(n_rows, dtype=np.int64)
+        nodes = np.broadcast_to(self.roots, (n_rows, self.n_trees)).astype(np.int64).ravel()
+        rows = np.repeat(np.arange(n_rows), self.n_trees)
+        offsets = rows * n_features
+        for depth in range(self.max_depth + 1):
+            if depth % check_every == check_every - 1 or depth == self.max_depth:
+                finished = self.is_leaf[nodes]
+                if finished.any():
+                    # Walkers stay ordered by row, so each row's finished trees form one contiguous run
+                    finished_rows = rows[finished]
+                    run_starts = np.flatnonzero(np.r_[True, finished_rows[1:] != finished_rows[:-1]])
+                    updated_rows = finished_rows[run_starts]
+                    run_bounds = np.r_[run_starts, len(finished_rows)]
+                    votes[updated_rows] += self.sum_leaf_runs(self.leaf_slot[nodes[finished]], run_bounds)
+                    trees_used[updated_rows] += np.diff(run_bounds)
+                    walking = ~finished
+                    rows, nodes, offsets = rows[walking], nodes[walking], offsets[walking]
+                    if len(nodes) == 0:
+                        break
+
+                    # Only rows that just got votes can have become settled, and without a confidence
+                    # bound only once more than half of their trees have voted
+                    candidates = updated_rows if confidence > 0 else updated_rows[2 * trees_used[updated_rows] > self.n_trees]
+                    settled_rows = self.settled_rows(votes, trees_used, candidates, confidence, min_trees)
+                    if len(settled_rows):
+                        settled_mask = np.zeros(n_rows, dtype=bool)
+                        settled_mask[settled_rows] = True
+                        walking = ~settled_mask[rows]
+                        rows, nodes, offsets = rows[walking], nodes[walking], offsets[walking]
+                        if len(nodes) == 0:
+                            break
+            nodes = self.children[2 * nodes + bits[offsets + self.feature[nodes]]]
+        return votes / trees_used[:, None], trees_used
+
+    def settled_rows(self, votes, trees_used, candidates, confidence, min_trees=1):
+        # Candidate rows whose leader is out of reach of the trees still walking, or past the confidence bound
+        if len(candidates) == 0:
+            return candidates
+        candidate_votes = votes[candidates]
+        position = np.arange(len(candidates))
+        leader_idx = candidate_votes.argmax(axis=1)
+        leader = candidate_votes[position, leader_idx]
+        # Runner-up found by masking out the leader, cheaper than a partition over every class
+        candidate_votes[position, leader_idx] = -np.inf
+        runner_up = candidate_votes.max(axis=1) if self.n_classes > 1 else np.zeros(len(candidates))
+        used = trees_used[candidates]
+        settled = leader - runner_up > self.n_trees - used
+        if confidence > 0:
+            settled |= (leader >= confidence * used) & (used >= min_trees)
+        return candidates[settled]
+
+
+def as_binary_matrix(X):
+    # Accept dense vectors, dense matrices or scipy sparse matrices of 0/1 flags
+    if hasattr(X, "toarray"):
+        X = X.toarray()
+    X = np.asarray(X)
+    if X.ndim == 1:
+        X = X[None, :]
+    return (X != 0).view(np.uint8)
+
+
+def verify_parity(flat_forest, model, n_features, n_samples=32, density=0.02, seed=0):
+    # Compare against sklearn's predict_proba on the empty vector plus random sparse symptom vectors.
+    # Returns the largest absolute probability difference and the number of argmax disagreements.
+    rng = np.random.RandomState(seed)
+    X = (rng.rand(n_samples, n_features) < density).astype(np.float32)
+    X[0] = 0
+    expected = model.predict_proba(X)
+    actual = flat_forest.predict_proba(X)
+    max_diff = float(np.abs(expected - actual).max())
+    # Exact ties can legitimately break either way after float summation, so only count decisive rows
+    top_two = np.sort(expected, axis=1)[:, -2:] if expected.shape[1] > 1 else np.hstack([expected, expected])
+    decisive = (top_two[:, 1] - top_two[:, 0]) > 1e-9
+    mismatches = int(((expected.argmax(axis=1) != actual.argmax(axis=1)) & decisive).sum())
+    return max_diff, mismatches
+
+
+def read_artifact_metadata(directory):
+    with open(os.path.join(directory, "metadata.json")) as f:
+        return json.load(f)
+
+
+def source_signature(path):
+    # Identifies the file an artifact (a flat export, a packed dataset) was built from, so stale ones can be detected
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def export_model(model_path, artifact_dir, verify_samples=32):
+    # Compile a pickled RandomForestClassifier, check it against sklearn and write the mmap-able artifact
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+    forest = FlatForest.from_estimators(model)
+    n_features = int(model.n_features_in_)
+
+    if verify_samples > 0:
+        max_diff, mismatches = verify_parity(forest, model, n_features, n_samples=verify_samples)
+        if max_diff > 1e-9 or mismatches:
+            raise ValueError(f"Flat forest parity check failed (max diff {max_diff}, {mismatches} mismatched predictions)")
+
+    forest.save(artifact_dir, {"n_features": n_features, "source": source_signature(model_path)})
+    return forest
+
+
+if __name__ == "__main__":
+    # Usage: python flat_forest.py export [model.pkl] [artifact_dir]
+    if len(sys.argv) < 2 or sys.argv[1] != "export":
+        print("Usage: python flat_forest.py export [model.pkl] [artifact_dir]")
+        sys.exit(1)
+    data_dir = os.environ.get("DATA_DIR", "./data")
+    model_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_dir, "optimized_rf_model.pkl")
+    artifact_dir = sys.argv[3] if len(sys.argv) > 3 else os.path.join(data_dir, "optimized_rf_model.flat")
+    forest = export_model(model_path, artifact_dir)
+    print(f"Exported {forest.n_trees} trees ({len(forest.feature)} nodes) to {artifact_dir}")
@@ -0,0 +1,350 @@
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+
+from benchmark import DEFAULT_CONFIG, ensure_fixtures, sample_inputs
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(data_dir, port, workers, extra_env, log_path):
+    # Started through main.py so multi-worker runs export the shared artifact first, exactly as deployed
+    env = {**os.environ, **extra_env, "DATA_DIR": data_dir, "PORT": str(port), "WORKERS": str(workers)}
+    log_file = open(log_path, "w")
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=API_DIR, env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    log_file.close()
+    return process
+
+
+def stop_server(process):
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def wait_until_ready(url, process, timeout):
+    # A worker only accepts connections once its lifespan has loaded the model
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode} during startup")
+        try:
+            response = httpx.get(url + "/", timeout=2)
+            if response.status_code == 200 and response.json().get("model_loaded"):
+                return response.json()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {url} was not ready after {timeout}s")
+
+
+def process_tree(root_pid):
+    # The server process and all its descendants: uvicorn workers, and inference processes when
+    # INFERENCE_EXECUTOR=process. Read from /proc, so memory is only reported on Linux.
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name is in parentheses and may contain spaces; ppid is the second field after it
+                parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree, frontier = [root_pid], [root_pid]
+    while frontier:
+        frontier = [pid for pid, ppid in parents.items() if ppid in frontier]
+        tree.extend(frontier)
+    return tree
+
+
+def memory_mb(pid):
+    # RSS counts shared pages (the memory-mapped forest) in every process; PSS splits them between
+    # the processes sharing them, so PSS values add up to the real footprint
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_mb"] = int(line.split()[1]) / 1024
+        if os.path.exists(f"/proc/{pid}/smaps_rollup"):
+            with open(f"/proc/{pid}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        usage["pss_mb"] = int(line.split()[1]) / 1024
+        with open(f"/proc/{pid}/cmdline") as f:
+            usage["command"] = " ".join(f.read().split("\0")).strip()
+    except OSError:
+        return None
+    return usage
+
+
+class MemorySampler:
+    # Polls the server's process tree in a background thread, keeping each process's peak
+    def __init__(self, root_pid, interval=0.5):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        for pid in process_tree(self.root_pid):
+            usage = memory_mb(pid)
+            if usage is None:
+                continue
+            peak = self.peaks.get(pid)
+            if peak is None:
+                # Classified on the full command line: the multiprocessing flags that identify the resource
+                # tracker come after the first 80 characters kept for the report
+                peak = self.peaks[pid] = {"pid": pid, "command": usage["command"][:80], "role": self.role(pid, usage["command"])}
+            for key in ("rss_mb", "pss_mb"):
+                if key in usage:
+                    peak[f"peak_{key}"] = round(max(peak.get(f"peak_{key}", 0), usage[key]), 1)
+
+    def role(self, pid, command):
+        if pid == self.root_pid:
+            return "server"
+        if "resource_tracker" in command:
+            return "helper"
+        return "worker"
+
+    def start(self):
+        if os.path.isdir("/proc"):
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+            self.sample()
+        return sorted(self.peaks.values(), key=lambda usage: usage["pid"])
+
+
+def weighted_inputs(columns, distinct, seed):
+    # A pool of distinct symptom combinations with Zipf-like popularity: a few common presentations
+    # repeat often while the long tail is rarely seen, like real traffic hitting the prediction cache
+    pool = sample_inputs(columns, distinct, seed)
+    weights = 1.0 / np.arange(1, distinct + 1)
+    return pool, weights / weights.sum()
+
+
+class LoadRecorder:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = {}
+
+    def record(self, latency, status=None, error=None):
+        if error is not None:
+            self.errors[error] = self.errors.get(error, 0) + 1
+            return
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 200:
+            self.latencies.append(latency)
+
+    def summary(self, elapsed):
+        total = sum(self.statuses.values()) + sum(self.errors.values())
+        ok = self.statuses.get(200, 0)
+        latencies = np.asarray(self.latencies) * 1000
+        summary = {
+            "requests": total,
+            "ok": ok,
+            "elapsed_seconds": round(elapsed, 2),
+            "throughput_rps": round(ok / elapsed, 1) if elapsed > 0 else 0.0,
+            "error_rate": round((total - ok) / total, 4) if total else 0.0,
+            "status_codes": {str(status): count for status, count in sorted(self.statuses.items())},
+            "errors": self.errors,
+        }
+        if len(latencies):
+            summary["latency_ms"] = {
+                "mean": round(float(latencies.mean()), 2),
+                "p50": round(float(np.percentile(latencies, 50)), 2),
+                "p95": round(float(np.percentile(latencies, 95)), 2),
+                "p99": round(float(np.percentile(latencies, 99)), 2),
+                "max": round(float(latencies.max()), 2),
+            }
+        return summary
+
+
+async def send(client, symptoms, recorder, started):
+    try:
+        response = await client.post("/recommend", json={"symptoms": symptoms})
+        recorder.record(time.perf_counter() - started, status=response.status_code)
+    except httpx.HTTPError as e:
+        recorder.record(time.perf_counter() - started, error=type(e).__name__)
+
+
+async def run_closed_loop(client, pick, concurrency, duration):
+    # Fixed concurrency: each virtual user sends its next request as soon as the previous one returns
+    recorder = LoadRecorder()
+    deadline = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < deadline:
+            await send(client, pick(), recorder, time.perf_counter())
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return recorder, time.perf_counter() - start_time
+
+
+async def run_open_loop(client, pick, rps, duration):
+    # Fixed arrival rate: requests are sent on schedule whether or not earlier ones have returned. Latency is
+    # measured from the scheduled send time, so a stalled server can't hide its queueing delay.
+    recorder = LoadRecorder()
+    tasks = []
+    start_time = time.perf_counter()
+    for idx in range(int(rps * duration)):
+        scheduled = start_time + idx / rps
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(client, pick(), recorder, scheduled)))
+    await asyncio.gather(*tasks)
+    return recorder, time.perf_counter() - start_time
+
+
+async def drive(url, pick, args):
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        if args.rps:
+            run = lambda duration: run_open_loop(client, pick, args.rps, duration)
+        else:
+            run = lambda duration: run_closed_loop(client, pick, args.concurrency, duration)
+        if args.warmup > 0:
+            await run(args.warmup)
+        return await run(args.duration)
+
+
+def print_report(results):
+    load = results["load"]
+    print(f"\n{'requests':<18} {load['requests']}")
+    print(f"{'throughput':<18} {load['throughput_rps']} req/s")
+    print(f"{'error rate':<18} {load['error_rate']:.2%}  {load['status_codes']} {load['errors'] or ''}")
+    if "latency_ms" in load:
+        print(f"{'latency (ms)':<18} " + "  ".join(f"{key} {value}" for key, value in load["latency_ms"].items()))
+    if results.get("processes"):
+        print(f"\n{'pid':>8} {'role':<8} {'peak RSS MB':>12} {'peak PSS MB':>12}  command")
+        for usage in results["processes"]:
+            print(f"{usage['pid']:>8} {usage['role']:<8} {usage.get('peak_rss_mb', '-'):>12} "
+                  f"{usage.get('peak_pss_mb', '-'):>12}  {usage['command']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /recommend against a local server")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Test an already running server instead of starting one")
+    target.add_argument("--data-dir", help="Serve this data directory instead of the synthetic fixtures")
+    rate = parser.add_mutually_exclusive_group()
+    rate.add_argument("--concurrency", type=int, default=16, help="Requests kept in flight (default mode)")
+    rate.add_argument("--rps", type=float, help="Send requests at this fixed rate instead")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of unmeasured load sent first")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started server")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the started server, e.g. --env INFERENCE_EXECUTOR=process")
+    parser.add_argument("--distinct", type=int, default=1000, help="Distinct symptom combinations sent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=30, help="Per-request timeout in seconds")
+    parser.add_argument("--max-connections", type=int, default=256, help="Client connection pool size")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--fixtures", default=os.path.join(tempfile.gettempdir(), "doctor-api-benchmark"),
+                        help="Synthetic fixture directory, shared with benchmark.py")
+    parser.add_argument("--output", default="load_test_results.json", help="Where to write the results JSON")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    data_dir = args.data_dir
+    if args.url is None and data_dir is None:
+        ensure_fixtures(args.fixtures, DEFAULT_CONFIG)
+        data_dir = args.fixtures
+
+    process, sampler = None, None
+    url = args.url.rstrip("/") if args.url else None
+    try:
+        if url is None:
+            port = free_port()
+            url = f"http://127.0.0.1:{port}"
+            log_path = os.path.join(data_dir, "load_test_server.log")
+            print(f"Starting server on port {port} with {args.workers} worker(s), log in {log_path}")
+            process = start_server(os.path.abspath(data_dir), port, args.workers, extra_env, log_path)
+        server_info = wait_until_ready(url, process, args.startup_timeout)
+
+        # Symptom mixes come from the served model's own columns
+        if data_dir is not None:
+            with open(os.path.join(data_dir, "symptom_columns.pkl"), "rb") as f:
+                columns = list(pickle.load(f))
+        else:
+            columns = httpx.get(url + "/symptoms", timeout=args.timeout).json()["symptoms"]
+        pool, weights = weighted_inputs(columns, args.distinct, args.seed)
+        rng = np.random.RandomState(args.seed)
+        pick = lambda: pool[rng.choice(len(pool), p=weights)]
+
+        if process is not None:
+            sampler = MemorySampler(process.pid)
+            sampler.start()
+        mode = f"{args.rps} req/s" if args.rps else f"concurrency {args.concurrency}"
+        print(f"Sending /recommend at {mode} for {args.warmup}s warmup + {args.duration}s...")
+        recorder, elapsed = asyncio.run(drive(url, pick, args))
+        processes = sampler.stop() if sampler is not None else []
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    results = {
+        "config": {
+            "url": args.url,
+            "data_dir": data_dir,
+            "workers": args.workers if args.url is None else None,
+            "server_env": extra_env,
+            "mode": "rps" if args.rps else "concurrency",
+            "rps": args.rps,
+            "concurrency": None if args.rps else args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "distinct_inputs": args.distinct,
+            "cpu_count": os.cpu_count(),
+        },
+        "server": {key: server_info.get(key) for key in ("forest_engine", "early_exit", "model_estimators",
+                                                          "inference", "micro_batching")},
+        "load": recorder.summary(elapsed),
+        "processes": processes,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print_report(results)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,38 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
 import pandas as pd
+import orjson
 import numpy as np
+from scipy import sparse
 import pickle
 import os
 import uvicorn
 from contextlib import asynccontextmanager
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import threading
+import hashlib
+import bisect
+import hmac
+import io
+import csv
+import tempfile
+import fcntl
+import json
+import time
+import random
 import gc
 import logging
+from flat_forest import FlatForest, verify_parity, export_model, read_artifact_metadata, source_signature
+from metrics import REGISTRY, Counter as MetricCounter, Gauge, Histogram, recording_paused
 
 # Set up logging
-logging.basicConfig(level=logging.INFO, 
+# Per-request prediction details are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), 
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
@@ -19,11 +40,24 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load data and model on startup
+    global inference_executor, request_batcher, model_generation
     await load_model()
+    inference_executor = create_inference_executor()
+    if MICROBATCH_WINDOW_MS > 0:
+        logger.info(f"Micro-batching /recommend calls (window {MICROBATCH_WINDOW_MS} ms, up to {MICROBATCH_MAX_SIZE} per batch)")
+        request_batcher = MicroBatcher(MICROBATCH_WINDOW_MS, MICROBATCH_MAX_SIZE)
+    watcher = None
+    if MODEL_WATCH_INTERVAL > 0:
+        logger.info(f"Watching model files in {data_directory()} every {MODEL_WATCH_INTERVAL}s")
+        watcher = asyncio.get_running_loop().create_task(watch_model_files())
     yield
     # Clean up when application shuts down
-    global model, le, symptom_columns, diseases_df, faculty_df
-    del model, le, symptom_columns, diseases_df, faculty_df
+    if watcher is not None:
+        watcher.cancel()
+    if request_batcher is not None:
+        request_batcher.close()
+    inference_executor.shutdown(wait=False, cancel_futures=True)
+    model_generation = None
     gc.collect()
 
 app = FastAPI(
@@ -42,38 +76,647 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class RequestMetricsMiddleware:
+    # Plain ASGI middleware (much cheaper per request than BaseHTTPMiddleware) that counts and times every
+    # HTTP request. Unknown paths share one "other" label so scanners can't create unbounded series.
+    def __init__(self, app):
+        self.app = app
+        self.endpoints = None
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if self.endpoints is None:
+                self.endpoints = {route.path for route in app.routes}
+            endpoint = scope["path"] if scope["path"] in self.endpoints else "other"
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            REQUEST_COUNT.labels(endpoint, status).inc()
+
+app.add_middleware(RequestMetricsMiddleware)
+
 # Request model
 class SymptomRequest(BaseModel):
     symptoms: str  # Comma-separated symptoms
 
+# Batch request model
+class BatchSymptomRequest(BaseModel):
+    symptoms: List[str]  # One comma-separated symptom string per case
+
 # Response model
 class DoctorRecommendation(BaseModel):
     predicted_disease: str
     doctors: list
-    debug_info: dict
+    debug_info: Optional[dict] = None  # Only with ?debug=true
 
-# Global variables for models and data
-model = None
-le = None
-symptom_columns = None
-diseases_df = None
-faculty_df = None
+# The loaded model and data as one ModelGeneration; a reload replaces it with a single assignment
+model_generation = None
 
-async def load_model():
-    global model, le, symptom_columns, diseases_df, faculty_df
+# "flat" serves predictions from the compiled FlatForest, "sklearn" keeps model.predict_proba only
+FOREST_ENGINE = os.environ.get("FOREST_ENGINE", "flat").lower()
+# Random vectors checked against model.predict_proba before the flat engine is trusted (0 skips the check)
+FOREST_VERIFY_SAMPLES = int(os.environ.get("FOREST_VERIFY_SAMPLES", 32))
+# "auto" serves from the memory-mapped optimized_rf_model.flat export when it matches the pickle, "off" ignores it,
+# "lossy" also serves exports compact_model.py wrote with lossy options (or before it kept duplicate trees)
+MODEL_ARTIFACT = os.environ.get("MODEL_ARTIFACT", "auto").lower()
+
+# "on" tallies the flat forest's votes every EARLY_EXIT_CHECK_STEPS levels as trees reach their leaves and stops once
+# the leading disease cannot be overtaken by the unfinished trees, or its mean probability reaches
+# EARLY_EXIT_CONFIDENCE (0 disables that bound) after at least EARLY_EXIT_MIN_TREES trees have voted
+# (0 picks a quarter of the forest, at least 8)
+EARLY_EXIT = os.environ.get("EARLY_EXIT", "off").lower()
+EARLY_EXIT_CHECK_STEPS = int(os.environ.get("EARLY_EXIT_CHECK_STEPS", 16))
+EARLY_EXIT_CONFIDENCE = float(os.environ.get("EARLY_EXIT_CONFIDENCE", 0))
+EARLY_EXIT_MIN_TREES = int(os.environ.get("EARLY_EXIT_MIN_TREES", 0))
+
+# Number of symptom combinations whose predictions are kept in the LRU cache (0 disables it)
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 4096))
+
+# Methods whose result depends only on the symptom vector, so they are safe to cache
+CACHEABLE_METHODS = {"flat_forest", "flat_forest_batch", "predict_proba", "predict_proba_batch", "predict"}
+
+# uvicorn worker processes started by `python main.py`; above 1 they share the exported flat artifact
+WORKERS = int(os.environ.get("WORKERS", 1))
+
+# Inference runs off the event loop on a bounded pool: "thread" (default) or "process"
+INFERENCE_EXECUTOR = os.environ.get("INFERENCE_EXECUTOR", "thread").lower()
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", min(4, os.cpu_count() or 1)))
+# Requests allowed to wait for a free inference worker before new ones are rejected with 503
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", 64))
+RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", 1))
+
+inference_executor = None
+inference_in_flight = 0
+
+# Concurrent /recommend calls arriving within MICROBATCH_WINDOW_MS of each other (0 disables it), up to
+# MICROBATCH_MAX_SIZE of them, are predicted together as one batch
+MICROBATCH_WINDOW_MS = float(os.environ.get("MICROBATCH_WINDOW_MS", 0))
+MICROBATCH_MAX_SIZE = int(os.environ.get("MICROBATCH_MAX_SIZE", 64))
+
+request_batcher = None
+
+# Upper bound on cases accepted by /recommend/batch in a single call
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 5000))
+
+# Rows of a /recommend/stream upload predicted together; memory use depends on this, not on the upload size
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 500))
+# Uploads larger than this are buffered on disk instead of in memory while they are processed
+STREAM_SPOOL_BYTES = 1 << 20
+# Largest /recommend/stream upload accepted, in bytes; bigger ones are rejected with 413 (0 disables the limit)
+STREAM_MAX_BYTES = int(os.environ.get("STREAM_MAX_BYTES", 256 << 20))
+STREAM_FORMATS = {"application/x-ndjson": "ndjson", "application/jsonl": "ndjson", "text/csv": "csv"}
+
+# Largest number of suggestions /symptoms/suggest returns for one query
+SUGGEST_MAX_LIMIT = 50
+# Share of the query's trigrams a symptom name must contain to be suggested as a likely typo
+SUGGEST_FUZZY_THRESHOLD = float(os.environ.get("SUGGEST_FUZZY_THRESHOLD", 0.5))
+# Names sharing the most trigrams with a query that are checked for a small edit distance
+SUGGEST_EDIT_CANDIDATES = 50
+
+# Seconds between checks of DATA_DIR for a changed model or reference sheet, which trigger a reload (0 disables it)
+MODEL_WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", 0))
+# Token expected in the X-Admin-Token header by /admin/reload; the endpoint is disabled while unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Symptom inputs predicted by a newly loaded generation before it serves traffic
+WARMUP_SAMPLES = int(os.environ.get("WARMUP_SAMPLES", 32))
+
+reload_in_progress = False
+
+# Prometheus metrics served on /metrics. Batch predictions are timed once per batch, every other stage once per case.
+REQUEST_COUNT = MetricCounter("doctor_api_requests_total", "HTTP requests by endpoint and status code", ["endpoint", "status"])
+REQUEST_SECONDS = Histogram("doctor_api_request_duration_seconds", "HTTP request latency by endpoint", ["endpoint"])
+STAGE_SECONDS = Histogram("doctor_api_stage_duration_seconds", "Time spent in each stage of a recommendation", ["stage"])
+PARSE_SECONDS = STAGE_SECONDS.labels("parse")
+VECTORIZE_SECONDS = STAGE_SECONDS.labels("vectorize")
+LABEL_DECODE_SECONDS = STAGE_SECONDS.labels("label_decode")
+DOCTOR_LOOKUP_SECONDS = STAGE_SECONDS.labels("doctor_lookup")
+PREDICT_SECONDS = Histogram("doctor_api_predict_duration_seconds", "Model prediction latency by prediction method", ["method"])
+PREDICTIONS = MetricCounter("doctor_api_predictions_total", "Predictions by prediction method, including cache hits", ["method"])
+PREDICTION_FAILURES = MetricCounter("doctor_api_prediction_method_failures_total",
+                                    "Prediction methods that failed and fell through to the next one", ["method"])
+MODEL_LOADS = MetricCounter("doctor_api_model_loads_total", "Model loads by outcome", ["result"])
+MODEL_LOAD_SECONDS = Gauge("doctor_api_model_load_duration_seconds", "Duration of the last successful model load")
+Gauge("doctor_api_model_generation", "Number of the model generation being served, 1 at startup").set_function(
+    lambda: model_generation.number if model_generation is not None else 0)
+STREAM_ROWS = MetricCounter("doctor_api_stream_rows_total", "Rows processed by /recommend/stream by result", ["result"])
+INFERENCE_REJECTED = MetricCounter("doctor_api_inference_rejected_total",
+                                   "Requests answered with 503 because the inference queue was full")
+Gauge("doctor_api_inference_in_flight", "Requests running on or waiting for the inference pool").set_function(
+    lambda: inference_in_flight)
+MetricCounter("doctor_api_prediction_cache_lookups_total", "Prediction cache lookups by result", ["result"]).set_function(
+    lambda: {("hit",): model_generation.prediction_cache.hits, ("miss",): model_generation.prediction_cache.misses}
+    if model_generation is not None else {})
+Gauge("doctor_api_prediction_cache_entries", "Symptom combinations held in the prediction cache").set_function(
+    lambda: len(model_generation.prediction_cache._entries) if model_generation is not None else 0)
+
+# Doctor returned when the predicted disease's department has no faculty
+DEFAULT_DOCTORS = [
+    {"Name": "Dr. General Medicine", "Designation": "General Physician", "Department": "Medicine"}
+]
+
+def dump_json(value):
+    # orjson writes numpy scalars and non-string keys directly (and NaN as null); anything else falls back to str
+    return orjson.dumps(value, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+DEFAULT_DOCTORS_JSON = [dump_json(doctor) for doctor in DEFAULT_DOCTORS]
+
+class SymptomMatcher:
+    # Maps every substring of every lowercased symptom column to the columns containing it.
+    # An input symptom activates a column exactly when it is a substring of the column name,
+    # so a single dict lookup per input symptom reproduces the old nested `in` scan.
+    def __init__(self, columns):
+        self.vector_length = len(columns)
+        index = {}
+        for col_idx, column in enumerate(columns):
+            name = str(column).lower()
+            substrings = {name[start:end] for start in range(len(name)) for end in range(start + 1, len(name) + 1)}
+            for sub in substrings:
+                index.setdefault(sub, []).append(col_idx)
+        # The empty string (e.g. from a trailing comma) is a substring of every column
+        if columns:
+            index[""] = range(len(columns))
+        self._index = {sub: tuple(col_idxs) for sub, col_idxs in index.items()}
+
+    def match(self, input_symptoms):
+        # Returns the sorted active column indices and how many input symptoms matched any column
+        active = set()
+        matched_count = 0
+        for sym in input_symptoms:
+            col_idxs = self._index.get(sym)
+            if col_idxs:
+                matched_count += 1
+                active.update(col_idxs)
+        return tuple(sorted(active)), matched_count
     
-    logger.info("Loading datasets and model...")
+    def column_hits(self, input_symptoms):
+        # How many input symptoms are substrings of each column, as parallel index and count arrays
+        hits = Counter()
+        for sym in input_symptoms:
+            hits.update(self._index.get(sym, ()))
+        return np.fromiter(hits.keys(), dtype=np.int64, count=len(hits)), np.fromiter(hits.values(), dtype=np.float64, count=len(hits))
+
+def normalize_symptom(text):
+    return " ".join(str(text).lower().split())
+
+def symptom_trigrams(text):
+    # Padded at the start only, so a partly typed last word still shares all its trigrams with the full name
+    padded = f"  {text}"
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+def prefix_edit_distance(query, text, max_edits):
+    # Optimal string alignment distance (insertions, deletions, substitutions and adjacent transpositions)
+    # between query and the closest prefix of text, so "feevr" is one edit from "fever pain".
+    # Only cells within max_edits of the diagonal can stay within max_edits, so only those are computed,
+    # and it gives up with max_edits + 1 as soon as no alignment can.
+    over = max_edits + 1
+    previous2, previous = None, [min(j, over) for j in range(len(text) + 1)]
+    for i in range(1, len(query) + 1):
+        current = [over] * (len(text) + 1)
+        if i <= max_edits:
+            current[0] = i
+        for j in range(max(1, i - max_edits), min(len(text), i + max_edits) + 1):
+            cell = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (query[i - 1] != text[j - 1]))
+            if i > 1 and j > 1 and query[i - 1] == text[j - 2] and query[i - 2] == text[j - 1]:
+                cell = min(cell, previous2[j - 2] + 1)
+            current[j] = min(cell, over)
+        if min(current) > max_edits:
+            return over
+        previous2, previous = previous, current
+    return min(previous)
+
+def allowed_edits(query):
+    # One typo in a short word, two in longer queries
+    return 1 if len(query) <= 5 else 2
+
+class SymptomSuggester:
+    # Autocomplete over the symptom columns, ranked: names starting with the query, then names with a later word
+    # starting with it, then names containing it anywhere (what /recommend matches on), then likely typos.
+    # Prefixes are found by bisecting a sorted list of every word-start suffix of every name, which gives the
+    # same lookups as a trie over word starts with two flat lists. Typos come from a trigram index, with the
+    # closest candidates re-ranked by edit distance so transposed or mistyped letters in short words still match.
+    def __init__(self, columns):
+        self.names = [str(column) for column in columns]
+        self.normalized = [normalize_symptom(name) for name in self.names]
+        
+        suffixes = []
+        self._word_starts = []
+        for col_idx, name in enumerate(self.normalized):
+            word_starts = [0] + [pos + 1 for pos, char in enumerate(name) if char == " "]
+            self._word_starts.append(word_starts)
+            suffixes.extend((name[start:], col_idx, start == 0) for start in word_starts)
+        suffixes.sort()
+        self._suffixes = [suffix for suffix, _, _ in suffixes]
+        self._suffix_columns = [(col_idx, whole_name) for _, col_idx, whole_name in suffixes]
+        
+        postings = {}
+        for col_idx, name in enumerate(self.normalized):
+            for trigram in symptom_trigrams(name):
+                postings.setdefault(trigram, []).append(col_idx)
+        self._trigrams = {trigram: np.array(col_idxs, dtype=np.int32) for trigram, col_idxs in postings.items()}
+    
+    def suggest(self, query, limit):
+        # Returns up to limit {"symptom", "match"} dicts, best first
+        query = normalize_symptom(query)
+        if not query:
+            return []
+        results = []
+        seen = set()
+        
+        def add(col_idx, match):
+            if col_idx not in seen:
+                seen.add(col_idx)
+                results.append({"symptom": self.names[col_idx], "match": match})
+        
+        # Every suffix starting with the query sorts between the query itself and the query followed by U+FFFF
+        start = bisect.bisect_left(self._suffixes, query)
+        stop = bisect.bisect_left(self._suffixes, query + "\uffff", lo=start)
+        prefix_hits = sorted(self._suffix_columns[start:stop], key=lambda hit: (not hit[1], len(self.normalized[hit[0]]), hit[0]))
+        for col_idx, whole_name in prefix_hits:
+            add(col_idx, "prefix" if whole_name else "word_prefix")
+        if len(results) < limit:
+            substring_hits = [col_idx for col_idx, name in enumerate(self.normalized) if query in name and col_idx not in seen]
+            for col_idx in sorted(substring_hits, key=lambda col_idx: len(self.normalized[col_idx])):
+                add(col_idx, "substring")
+        
+        # Likely typos, for queries long enough to have a few trigrams: the names sharing the most trigrams with
+        # the query are kept if a word in them starts within a typo or two of it, or if they share most trigrams
+        if len(results) < limit and len(query) >= 3:
+            query_trigrams = [trigram for trigram in symptom_trigrams(query) if trigram in self._trigrams]
+            if query_trigrams:
+                shared = np.bincount(np.concatenate([self._trigrams[trigram] for trigram in query_trigrams]), minlength=len(self.names))
+                similarity = shared / len(symptom_trigrams(query))
+                candidates = np.flatnonzero(shared)
+                candidates = candidates[np.argsort(-shared[candidates], kind="stable")[:SUGGEST_EDIT_CANDIDATES]]
+                max_edits = allowed_edits(query)
+                # Distances by compared text: names often share words, which need checking only once
+                distances = {}
+                ranked = []
+                for col_idx in candidates:
+                    if col_idx in seen:
+                        continue
+                    name = self.normalized[col_idx]
+                    edits = max_edits + 1
+                    for start in self._word_starts[col_idx]:
+                        text = name[start:start + len(query) + max_edits]
+                        if text not in distances:
+                            distances[text] = prefix_edit_distance(query, text, max_edits)
+                        edits = min(edits, distances[text])
+                    if edits <= max_edits or similarity[col_idx] >= SUGGEST_FUZZY_THRESHOLD:
+                        ranked.append((edits, -similarity[col_idx], len(name), int(col_idx)))
+                for _, _, _, col_idx in sorted(ranked)[:limit - len(results)]:
+                    add(col_idx, "fuzzy")
+        return results[:limit]
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match may list several tags, weak ones prefixed with W/, or be *
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+def compile_flat_forest(model, n_features):
+    # Compile the forest into flat arrays and check parity with sklearn before serving from it
+    if FOREST_ENGINE != "flat":
+        logger.info(f"Flat forest engine disabled (FOREST_ENGINE={FOREST_ENGINE})")
+        return None
+    
+    try:
+        compiled = FlatForest.from_estimators(model)
+        logger.info(f"Compiled flat forest: {compiled.n_trees} trees, {len(compiled.feature)} nodes, max depth {compiled.max_depth}")
+    except Exception as e:
+        logger.warning(f"Could not compile flat forest, using sklearn predict_proba: {str(e)}")
+        return None
+    
+    if FOREST_VERIFY_SAMPLES > 0:
+        try:
+            max_diff, mismatches = verify_parity(compiled, model, n_features, n_samples=FOREST_VERIFY_SAMPLES)
+        except Exception as e:
+            logger.warning(f"Flat forest parity check could not run, using sklearn predict_proba: {str(e)}")
+            return None
+        if max_diff > 1e-9 or mismatches:
+            logger.error(f"Flat forest parity check failed (max diff {max_diff}, {mismatches} mismatched predictions), using sklearn predict_proba")
+            return None
+        logger.info(f"Flat forest parity check passed on {FOREST_VERIFY_SAMPLES} vectors (max diff {max_diff})")
+    
+    return compiled
+
+class PredictionCache:
+    # Bounded LRU cache keyed by the sorted tuple of active column indices.
+    # Values are (predicted_disease, prediction_method, prediction_confidence).
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        # Drops every entry and zeroes the statistics
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+class ModelGeneration:
+    # One loaded model together with everything derived from it, never modified after construction.
+    # Requests read model_generation once and pass that object along, so a reload swapping in a new generation
+    # never mixes two models within a request, and requests already running finish on the one they started with.
+    def __init__(self, number, model, le, symptom_columns, symptom_matcher, symptom_suggester, flat_forest, symptom_disease_index,
+                 diseases_df, faculty_df, disease_departments, department_doctors, sources):
+        self.number = number
+        self.model = model
+        self.le = le
+        self.symptom_columns = symptom_columns
+        self.symptom_matcher = symptom_matcher
+        self.symptom_suggester = symptom_suggester
+        # /symptoms is served from these bytes; the ETag changes only when the column list does
+        self.symptoms_json = dump_json({"symptoms": [str(column) for column in symptom_columns]})
+        self.symptoms_etag = f'"{hashlib.sha256(self.symptoms_json).hexdigest()[:32]}"'
+        self.flat_forest = flat_forest
+        self.symptom_disease_index = symptom_disease_index
+        self.diseases_df = diseases_df
+        self.faculty_df = faculty_df
+        self.disease_departments = disease_departments
+        self.department_doctors = department_doctors
+        # Each doctor record serialized once, so responses are assembled from bytes instead of encoding dicts
+        self.department_doctors_json = {department: tuple(dump_json(record) for record in records)
+                                        for department, records in department_doctors.items()}
+        # Signatures of the files this generation was loaded from, compared by the DATA_DIR watcher
+        self.sources = sources
+        self.loaded_at = time.time()
+        # Each generation caches its own predictions, so a previous model's can never be served
+        self.prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE)
+    
+    def estimators_count(self):
+        if self.model is not None and hasattr(self.model, 'estimators_'):
+            return len(self.model.estimators_)
+        return self.flat_forest.n_trees if self.flat_forest is not None else 0
+    
+    def describe(self):
+        return {
+            "number": self.number,
+            "loaded_at": self.loaded_at,
+            "symptom_count": len(self.symptom_columns),
+            "classes_count": len(self.le.classes_),
+            "model_estimators": self.estimators_count(),
+            "forest_engine": "flat" if self.flat_forest is not None else "sklearn"
+        }
+
+def apply_cached_prediction(cached, debug_info):
+    predicted_disease, prediction_method, prediction_confidence = cached
+    debug_info["prediction_method"] = prediction_method
+    debug_info["cache_hit"] = True
+    if prediction_confidence is not None:
+        debug_info["prediction_confidence"] = prediction_confidence
+    return predicted_disease, debug_info
+
+def cache_prediction(generation, active_indices, predicted_disease, debug_info):
+    if debug_info["prediction_method"] in CACHEABLE_METHODS:
+        generation.prediction_cache.put(active_indices, (predicted_disease, debug_info["prediction_method"], debug_info.get("prediction_confidence")))
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_excel_cache(df, cache_path, source_meta):
+    # Store each column as a plain NumPy array (strings plus a null mask) so no pickling is needed
+    arrays = {}
+    columns = []
+    for idx, column in enumerate(df.columns):
+        series = df[column]
+        if not (isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufcmM"):
+            nulls = series.isna().to_numpy()
+            arrays[f"col{idx}"] = series.where(~nulls, "").astype(str).to_numpy(dtype=str)
+            arrays[f"null{idx}"] = nulls
+            columns.append({"name": str(column), "kind": "str"})
+        else:
+            arrays[f"col{idx}"] = series.to_numpy()
+            columns.append({"name": str(column), "kind": "raw"})
+    arrays["meta"] = np.array(json.dumps({**source_meta, "columns": columns}))
+    
+    # Write to a temporary file first so a concurrent reader never sees a partial cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write Excel cache {cache_path}: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def read_excel_cache(cache):
+    meta = json.loads(str(cache["meta"]))
+    data = {}
+    for idx, column in enumerate(meta["columns"]):
+        values = cache[f"col{idx}"]
+        if column["kind"] == "str":
+            values = values.astype(object)
+            values[cache[f"null{idx}"]] = np.nan
+        data[column["name"]] = values
+    return pd.DataFrame(data, columns=[column["name"] for column in meta["columns"]])
+
+def read_excel_cached(xlsx_path):
+    # Load a sheet from its compiled .cache.npz, re-parsing the .xlsx only when it has changed.
+    # The mtime/size check is free; the content hash decides when only the mtime moved.
+    start = time.perf_counter()
+    cache_path = f"{xlsx_path}.cache.npz"
+    stat = os.stat(xlsx_path)
+    source_meta = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    source_hash = None
+    
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as cache:
+                meta = json.loads(str(cache["meta"]))
+                fresh = meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size
+                if not fresh:
+                    source_hash = file_sha256(xlsx_path)
+                    fresh = meta["sha256"] == source_hash
+                if fresh:
+                    df = read_excel_cache(cache)
+                    if meta["mtime_ns"] != stat.st_mtime_ns:
+                        # Same content under a new mtime: refresh the key so the next start skips hashing
+                        write_excel_cache(df, cache_path, {**source_meta, "sha256": meta["sha256"]})
+                    logger.info(f"Loaded {os.path.basename(xlsx_path)} from cache in {time.perf_counter() - start:.3f}s")
+                    return df
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable Excel cache {cache_path}: {str(e)}")
+    
+    df = pd.read_excel(xlsx_path)
+    write_excel_cache(df, cache_path, {**source_meta, "sha256": source_hash or file_sha256(xlsx_path)})
+    logger.info(f"Parsed {os.path.basename(xlsx_path)} and rebuilt its cache in {time.perf_counter() - start:.3f}s")
+    return df
+
+def build_doctor_index(diseases_df, faculty_df):
+    # Normalized disease name -> department; the first row wins, as with the old iloc[0] lookup
+    disease_departments = {}
+    for disease, department in zip(diseases_df['Diseases'], diseases_df['Department']):
+        if isinstance(disease, str) and isinstance(department, str):
+            disease_departments.setdefault(disease.strip().lower(), department.strip())
+    
+    # Lowercased department -> tuple of doctor records, ready to sample from
+    grouped = {}
+    for record in faculty_df[['Name', 'Designation', 'Department']].to_dict(orient='records'):
+        if isinstance(record['Department'], str):
+            grouped.setdefault(record['Department'].lower(), []).append(record)
+    department_doctors = {department: tuple(records) for department, records in grouped.items()}
+    
+    return disease_departments, department_doctors
+
+def load_flat_artifact(artifact_path, model_path, n_features):
+    # Map the exported flat forest read-only; pages are shared by every process mapping the same files
+    if FOREST_ENGINE != "flat" or MODEL_ARTIFACT == "off" or not os.path.isdir(artifact_path):
+        return None
+    
+    try:
+        metadata = read_artifact_metadata(artifact_path)
+        if os.path.exists(model_path) and metadata.get("source") != source_signature(model_path):
+            logger.warning(f"Flat model artifact {artifact_path} was exported from a different pickle, ignoring it")
+            return None
+        if metadata.get("n_features") != n_features:
+            logger.warning(f"Flat model artifact expects {metadata.get('n_features')} features but we have {n_features} symptom columns, ignoring it")
+            return None
+        # Compacted artifacts without the flag predate lossless compaction
+        if "compaction" in metadata and metadata["compaction"].get("lossy", True) and MODEL_ARTIFACT != "lossy":
+            logger.warning(f"Flat model artifact {artifact_path} was compacted lossily with {metadata['compaction']}, ignoring it; set MODEL_ARTIFACT=lossy to serve it")
+            return None
+        forest, _ = FlatForest.load(artifact_path, mmap_mode="r")
+    except Exception as e:
+        logger.warning(f"Could not load flat model artifact, falling back to the pickle: {str(e)}")
+        return None
+    
+    logger.info(f"Memory-mapped flat forest from {artifact_path}: {forest.n_trees} trees, {len(forest.feature)} nodes, {forest.n_leaves} distinct leaves")
+    if "compaction" in metadata:
+        logger.info(f"Flat forest was compacted with {metadata['compaction']}")
+    return forest
+
+def ensure_flat_artifact():
+    # Export the flat artifact up front when it is missing or stale, so workers map it instead of unpickling
+    paths = model_file_paths(data_directory())
+    model_path, artifact_path = paths["model"], paths["artifact"]
+    if FOREST_ENGINE != "flat" or MODEL_ARTIFACT == "off" or not os.path.exists(model_path):
+        return
+    
+    # Every uvicorn worker calls this when it reloads; the lock lets one of them export while the others wait
+    # and then find the artifact up to date
+    with open(artifact_path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if os.path.isdir(artifact_path):
+            try:
+                if read_artifact_metadata(artifact_path).get("source") == source_signature(model_path):
+                    return
+            except Exception as e:
+                logger.warning(f"Existing flat model artifact is unreadable, re-exporting: {str(e)}")
+        
+        try:
+            logger.info(f"Exporting flat model artifact to {artifact_path}...")
+            forest = export_model(model_path, artifact_path, verify_samples=FOREST_VERIFY_SAMPLES)
+            logger.info(f"Exported {forest.n_trees} trees to {artifact_path}")
+        except Exception as e:
+            logger.warning(f"Could not export flat model artifact, workers will unpickle the model: {str(e)}")
+
+def data_directory():
+    return os.environ.get("DATA_DIR", "./data")
+
+def model_file_paths(data_dir):
+    return {
+        "model": os.path.join(data_dir, "optimized_rf_model.pkl"),
+        "artifact": os.path.join(data_dir, "optimized_rf_model.flat"),
+        "encoder": os.path.join(data_dir, "label_encoder.pkl"),
+        "columns": os.path.join(data_dir, "symptom_columns.pkl"),
+        "index": os.path.join(data_dir, "symptom_disease_index.npz"),
+        "diseases": os.path.join(data_dir, "Mapped_Diseases_Final2.xlsx"),
+        "faculty": os.path.join(data_dir, "Faculty_Cleaned_ML.xlsx")
+    }
+
+def model_file_signatures(data_dir):
+    # mtime and size of every file a generation is loaded from; the artifact's metadata.json is written last
+    signatures = {}
+    for name, path in model_file_paths(data_dir).items():
+        if name == "artifact":
+            path = os.path.join(path, "metadata.json")
+        if os.path.exists(path):
+            signatures[name] = source_signature(path)
+    return signatures
+
+def forest_loaded():
+    return model_generation is not None
+
+def load_symptom_disease_index(index_path, n_symptoms, n_classes):
+    # Sparse (symptoms x classes) co-occurrence counts written by the training script for the fallback path
+    if not os.path.exists(index_path):
+        logger.warning(f"Symptom-disease index not found at {index_path}, symptom matching fallback disabled")
+        return None
+    
+    index = sparse.load_npz(index_path).tocsr()
+    if index.shape != (n_symptoms, n_classes):
+        logger.warning(f"Symptom-disease index has shape {index.shape} but the model has {n_symptoms} symptoms and {n_classes} classes, ignoring it")
+        return None
+    
+    logger.info(f"Loaded symptom-disease index with {index.nnz} non-zero entries")
+    return index
+
+def build_generation(number, strict=False):
+    logger.info(f"Loading datasets and model (generation {number})...")
+    load_start = time.perf_counter()
     
     # Paths to data files
-    data_dir = os.environ.get("DATA_DIR", "./data")
-    model_path = os.path.join(data_dir, "optimized_rf_model.pkl")
-    encoder_path = os.path.join(data_dir, "label_encoder.pkl")
-    columns_path = os.path.join(data_dir, "symptom_columns.pkl")
-    diseases_path = os.path.join(data_dir, "Mapped_Diseases_Final2.xlsx")
-    faculty_path = os.path.join(data_dir, "Faculty_Cleaned_ML.xlsx")
+    data_dir = data_directory()
+    paths = model_file_paths(data_dir)
+    model_path, artifact_path, encoder_path, columns_path = paths["model"], paths["artifact"], paths["encoder"], paths["columns"]
+    index_path, diseases_path, faculty_path = paths["index"], paths["diseases"], paths["faculty"]
+    # Taken before reading anything, so a file replaced during the load still looks changed to the watcher
+    sources = model_file_signatures(data_dir)
     
     # Check if pickle files exist, if not train the model
-    if not all(os.path.exists(p) for p in [model_path, encoder_path, columns_path]):
+    if not all(os.path.exists(p) for p in [encoder_path, columns_path]) or not (os.path.exists(model_path) or os.path.isdir(artifact_path)):
         logger.error("Pre-trained model files not found. Please run train_model.py first.")
         raise FileNotFoundError(f"Required pickle files not found. Run train_model.py first.")
     
@@ -83,20 +726,15 @@ async def load_model():
             logger.error(f"Error: {name} file not found at {path}")
             raise FileNotFoundError(f"Required data file not found: {path}")
     
+    # Start loading both reference sheets in the background while the model is unpickled
+    excel_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="excel-load")
+    diseases_future = excel_pool.submit(read_excel_cached, diseases_path)
+    faculty_future = excel_pool.submit(read_excel_cached, faculty_path)
+    
     try:
         # Load pre-trained model and required data
         logger.info("Loading pre-trained model from pickle files...")
         
-        # Load model with diagnostic info
-        with open(model_path, "rb") as f:
-            model = pickle.load(f)
-        logger.info(f"Model type: {type(model).__name__}")
-        
-        # Check model structure
-        if not hasattr(model, 'estimators_') or len(model.estimators_) == 0:
-            logger.error("Model has no estimators or is improperly structured")
-            raise ValueError("Invalid model structure")
-            
         # Load label encoder
         with open(encoder_path, "rb") as f:
             le = pickle.load(f)
@@ -107,114 +745,390 @@ async def load_model():
             symptom_columns = pickle.load(f)
         logger.info(f"Loaded {len(symptom_columns)} symptom columns")
         
-        # Test a tree to verify functionality - try to predict with first estimator
-        try:
-            first_tree = model.estimators_[0]
-            test_vector = np.zeros(len(symptom_columns))
-            test_pred = first_tree.predict([test_vector])
-            logger.info(f"Test prediction from first tree: {test_pred}")
-        except Exception as e:
-            logger.error(f"Test prediction failed: {str(e)}")
-            # This helps diagnose if the trees are properly structured
+        # Build the symptom matcher once so requests don't rescan every column name
+        symptom_matcher = SymptomMatcher(list(symptom_columns))
+        logger.info(f"Symptom matcher indexed {len(symptom_matcher._index)} column substrings")
+        symptom_suggester = SymptomSuggester(list(symptom_columns))
+        logger.info(f"Symptom suggester indexed {len(symptom_suggester._suffixes)} word prefixes and {len(symptom_suggester._trigrams)} trigrams")
+        
+        # Load the fallback index once instead of re-reading the training CSV per request
+        symptom_disease_index = load_symptom_disease_index(index_path, len(symptom_columns), len(le.classes_))
+        
+        # Prefer the memory-mapped flat export, which skips unpickling the forest entirely
+        model = None
+        flat_forest = load_flat_artifact(artifact_path, model_path, len(symptom_columns))
+        
+        if flat_forest is None:
+            # Load model with diagnostic info
+            with open(model_path, "rb") as f:
+                model = pickle.load(f)
+            logger.info(f"Model type: {type(model).__name__}")
+            
+            # Check model structure
+            if not hasattr(model, 'estimators_') or len(model.estimators_) == 0:
+                logger.error("Model has no estimators or is improperly structured")
+                raise ValueError("Invalid model structure")
+            
+            # Test a tree to verify functionality - try to predict with first estimator
+            try:
+                first_tree = model.estimators_[0]
+                test_vector = np.zeros(len(symptom_columns))
+                test_pred = first_tree.predict([test_vector])
+                logger.info(f"Test prediction from first tree: {test_pred}")
+            except Exception as e:
+                logger.error(f"Test prediction failed: {str(e)}")
+                # This helps diagnose if the trees are properly structured
+            
+            # Check model and columns compatibility (load_flat_artifact checks the artifact's own feature count)
+            if hasattr(model, 'n_features_in_'):
+                expected_features = model.n_features_in_
+                actual_features = len(symptom_columns)
+                if expected_features != actual_features:
+                    logger.warning(f"Model expects {expected_features} features but we have {actual_features} symptom columns")
+                else:
+                    logger.info(f"Feature count match confirmed: {expected_features} features")
+            
+            # Compile the native inference engine; predict_proba stays as the verification reference
+            flat_forest = compile_flat_forest(model, len(symptom_columns))
+
+            # Once the flat forest has matched predict_proba, the sklearn model would only be a fallback for a flat
+            # engine failure, as when serving the memory-mapped artifact, while holding most of the process's memory
+            if flat_forest is not None and FOREST_VERIFY_SAMPLES > 0:
+                logger.info("Releasing the sklearn model, the verified flat forest serves every prediction")
+                model = None
+
+        # An encoder from a different training run would silently mislabel every prediction. That fails a reload
+        # (strict), but at startup only warns: models written by older chunked training runs have no usable forest
+        # classes and are still served through the fallback chain, as before.
+        forest_classes = flat_forest.n_classes if flat_forest is not None else len(getattr(model, "classes_", le.classes_))
+        if forest_classes != len(le.classes_):
+            message = f"Model predicts {forest_classes} classes but the label encoder has {len(le.classes_)}"
+            if strict:
+                raise ValueError(message)
+            logger.warning(f"{message}; predictions may come from the fallbacks until the model is retrained")
         
         # Load mapping datasets
-        diseases_df = pd.read_excel(diseases_path)
-        faculty_df = pd.read_excel(faculty_path)
+        diseases_df = diseases_future.result()
+        faculty_df = faculty_future.result()
         
         # Clean faculty data
         faculty_df['Department'] = faculty_df['Department'].str.strip().str.strip(')')
         
+        # Index doctors by disease and department so lookups don't filter the sheets per request
+        disease_departments, department_doctors = build_doctor_index(diseases_df, faculty_df)
+        logger.info(f"Indexed {len(disease_departments)} diseases across {len(department_doctors)} departments")
+        
+        generation = ModelGeneration(number, model, le, symptom_columns, symptom_matcher, symptom_suggester, flat_forest, symptom_disease_index,
+                                     diseases_df, faculty_df, disease_departments, department_doctors, sources)
+        
         # Print diagnostic information
         logger.info("Model and data loaded successfully!")
         logger.info(f"Number of symptom columns: {len(symptom_columns)}")
         logger.info(f"Number of disease classes: {len(le.classes_)}")
-        logger.info(f"Number of estimators in model: {len(model.estimators_)}")
+        logger.info(f"Number of estimators in model: {generation.estimators_count()}")
         logger.info(f"Sample of classes: {list(le.classes_)[:5]}")
         
-        # Check model and columns compatibility
-        if hasattr(model, 'n_features_in_'):
-            expected_features = model.n_features_in_
-            actual_features = len(symptom_columns)
-            if expected_features != actual_features:
-                logger.warning(f"Model expects {expected_features} features but we have {actual_features} symptom columns")
-            else:
-                logger.info(f"Feature count match confirmed: {expected_features} features")
+        warm_up(generation, strict)
+        
+        MODEL_LOADS.labels("success").inc()
+        MODEL_LOAD_SECONDS.set(time.perf_counter() - load_start)
+        logger.info(f"Model load took {time.perf_counter() - load_start:.2f}s")
+        return generation
         
     except Exception as e:
+        MODEL_LOADS.labels("failure").inc()
         logger.error(f"Error loading model or data: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
         raise
+    finally:
+        excel_pool.shutdown(wait=True)
+
+def warm_up(generation, strict):
+    # Push sample inputs through the whole recommendation path before the generation serves traffic. This pages
+    # the forest and lookup tables in, so the first real requests aren't slow, and catches a model that only
+    # works through the fallbacks. That fails a reload (strict) but only warns at startup, as before.
+    if WARMUP_SAMPLES <= 0:
+        return
+    columns = [str(column) for column in generation.symptom_columns]
+    rng = random.Random(generation.number)
+    samples = [", ".join(rng.sample(columns, min(len(columns), rng.randint(1, 5)))) for _ in range(WARMUP_SAMPLES)]
+    start = time.perf_counter()
+    # Keep the warm-up predictions and their stage timings off /metrics
+    with recording_paused():
+        predictions = predict_diseases_batch(samples, generation)
+        predictions.append(predict_disease_from_symptoms(samples[0], generation))
+        for predicted_disease, debug_info in predictions:
+            get_doctors_by_disease(predicted_disease, generation)
+    # Warm-up inputs are random, so neither they nor their lookups should count as the generation's cache traffic
+    generation.prediction_cache.clear()
+    fallbacks = Counter(debug_info["prediction_method"] for _, debug_info in predictions if debug_info["prediction_method"] not in CACHEABLE_METHODS)
+    if fallbacks:
+        message = f"Warm-up predictions fell back to {dict(fallbacks)}"
+        if strict:
+            raise ValueError(message)
+        logger.warning(message)
+    logger.info(f"Warmed up generation {generation.number} with {len(predictions)} predictions in {time.perf_counter() - start:.3f}s")
+
+async def load_model():
+    global model_generation
+    model_generation = build_generation(1)
+
+async def reload_model(reason):
+    # Build, validate and warm the next generation off the event loop while the current one keeps serving,
+    # then swap it in with a single assignment
+    global model_generation, inference_executor, reload_in_progress
+    if reload_in_progress:
+        raise HTTPException(status_code=409, detail="A model reload is already in progress")
+    reload_in_progress = True
+    try:
+        logger.info(f"Reloading model: {reason}")
+        previous = model_generation
+        if WORKERS > 1:
+            # Refresh the shared export first, so this worker and the others map the new forest instead of
+            # each unpickling it
+            await asyncio.get_running_loop().run_in_executor(None, ensure_flat_artifact)
+        generation = await asyncio.get_running_loop().run_in_executor(None, build_generation, previous.number + 1, True)
+        model_generation = generation
+        if INFERENCE_EXECUTOR == "process" and inference_executor is not None:
+            # Worker processes hold their own copy of the model: replace the pool, letting the old one finish its tasks
+            previous_executor, inference_executor = inference_executor, create_inference_executor()
+            previous_executor.shutdown(wait=False)
+        logger.info(f"Now serving model generation {generation.number} (replaced generation {previous.number})")
+        return generation
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Model reload failed, still serving generation {model_generation.number}: {str(e)}")
+        raise
+    finally:
+        reload_in_progress = False
+
+async def watch_model_files():
+    # Reload once the files in DATA_DIR differ from the ones the current generation was loaded from and have
+    # stayed unchanged for a whole interval, so a file still being copied in is never loaded half-written.
+    # A set of files that failed to load is not retried until it changes again.
+    pending, failed = None, None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        try:
+            current = await asyncio.get_running_loop().run_in_executor(None, model_file_signatures, data_directory())
+        except OSError as e:
+            logger.warning(f"Could not check model files: {str(e)}")
+            continue
+        if current == model_generation.sources or current == failed:
+            pending = None
+            continue
+        if current != pending:
+            pending = current
+            continue
+        pending = None
+        try:
+            await reload_model("model files in DATA_DIR changed")
+        except HTTPException:
+            # A reload requested through /admin/reload is already running
+            continue
+        except Exception:
+            failed = current
+
+def flat_forest_proba(generation, X):
+    # Class probabilities from the flat forest and the number of trees evaluated for each row
+    if EARLY_EXIT == "on":
+        return generation.flat_forest.predict_proba_early_exit(
+            X, EARLY_EXIT_CHECK_STEPS, EARLY_EXIT_CONFIDENCE, EARLY_EXIT_MIN_TREES or None
+        )
+    proba = generation.flat_forest.predict_proba(X)
+    return proba, np.full(len(proba), generation.flat_forest.n_trees)
+
+def vectorize_symptoms(generation, symptom_input):
+    # Split the raw input and find the active columns and matched count in one pass
+    start = time.perf_counter()
+    input_symptoms = [sym.strip().lower() for sym in symptom_input.split(",")]
+    parsed = time.perf_counter()
+    active_indices, matched_count = generation.symptom_matcher.match(input_symptoms)
+    PARSE_SECONDS.observe(parsed - start)
+    VECTORIZE_SECONDS.observe(time.perf_counter() - parsed)
+    
+    debug_info = {
+        "symptoms_input": symptom_input,
+        "symptoms_processed": input_symptoms,
+        "symptoms_matched_count": matched_count,
+        "nonzero_features": len(active_indices),
+        "vector_length": generation.symptom_matcher.vector_length,
+        "classes_count": len(generation.le.classes_),
+        "estimators_count": generation.estimators_count(),
+        "prediction_method": "unknown"
+    }
+    return input_symptoms, active_indices, debug_info
+
+def decode_labels(generation, encoded):
+    start = time.perf_counter()
+    labels = generation.le.inverse_transform(encoded)
+    LABEL_DECODE_SECONDS.observe(time.perf_counter() - start)
+    return labels
 
-def predict_disease_from_symptoms(symptom_input):
-    global model, le, symptom_columns
+def build_feature_matrix(generation, active_rows):
+    # Sparse binary matrix with one row per case, built straight from the active column indices
+    indptr = np.zeros(len(active_rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(active) for active in active_rows])
+    indices = np.fromiter((idx for active in active_rows for idx in active), dtype=np.int32, count=int(indptr[-1]))
+    data = np.ones(len(indices), dtype=np.float32)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(active_rows), generation.symptom_matcher.vector_length))
+
+def predict_diseases_batch(symptom_inputs, generation=None):
+    generation = generation or model_generation
     
     # Safety check
-    if model is None or le is None or symptom_columns is None:
+    if generation is None:
         raise ValueError("Model or required data not loaded")
     
-    # Debug the input
-    logger.info(f"Input symptoms: {symptom_input}")
+    vectorized = [vectorize_symptoms(generation, symptom_input) for symptom_input in symptom_inputs]
+    results = [None] * len(vectorized)
     
-    # Create input vector
-    input_symptoms = [sym.strip().lower() for sym in symptom_input.split(",")]
-    logger.info(f"Processed symptoms: {input_symptoms}")
+    # Serve repeated symptom combinations from the cache and only run the forest on the rest
+    pending = []
+    for row, (_, active_indices, debug_info) in enumerate(vectorized):
+        cached = generation.prediction_cache.get(active_indices)
+        if cached is not None:
+            results[row] = apply_cached_prediction(cached, debug_info)
+            PREDICTIONS.labels(debug_info["prediction_method"]).inc()
+        else:
+            pending.append(row)
+    logger.debug(f"Predicting batch of {len(vectorized)} cases ({len(pending)} not cached)")
     
-    # Debug: count how many symptoms are actually in our columns
-    matched_symptoms = [s for s in input_symptoms if any(s in col.lower() for col in symptom_columns)]
-    logger.info(f"Found {len(matched_symptoms)}/{len(input_symptoms)} symptoms in model columns")
+    if not pending:
+        return results
+    
+    try:
+        # One predict_proba and one inverse_transform for the whole batch
+        X = build_feature_matrix(generation, [vectorized[row][1] for row in pending])
+        trees_used = None
+        start = time.perf_counter()
+        if generation.flat_forest is not None:
+            prediction_method = "flat_forest_batch"
+            proba, trees_used = flat_forest_proba(generation, X)
+        else:
+            prediction_method = "predict_proba_batch"
+            proba = generation.model.predict_proba(X)
+        pred_encoded = np.argmax(proba, axis=1)
+        PREDICT_SECONDS.labels(prediction_method).observe(time.perf_counter() - start)
+        predicted_diseases = decode_labels(generation, pred_encoded)
+    except Exception as e:
+        # Fall back to the per-case method chain, which handles malformed forests
+        PREDICTION_FAILURES.labels("flat_forest_batch" if generation.flat_forest is not None else "predict_proba_batch").inc()
+        logger.warning(f"Batch predict_proba failed, predicting cases one at a time: {str(e)}")
+        for row in pending:
+            results[row] = predict_disease_from_symptoms(symptom_inputs[row], generation)
+        return results
+    
+    for pending_idx, row in enumerate(pending):
+        _, active_indices, debug_info = vectorized[row]
+        debug_info["prediction_method"] = prediction_method
+        debug_info["prediction_confidence"] = float(proba[pending_idx, pred_encoded[pending_idx]])
+        if trees_used is not None:
+            debug_info["trees_used"] = int(trees_used[pending_idx])
+        cache_prediction(generation, active_indices, predicted_diseases[pending_idx], debug_info)
+        results[row] = (predicted_diseases[pending_idx], debug_info)
+    PREDICTIONS.labels(prediction_method).inc(len(pending))
+    return results
+
+def predict_disease_from_symptoms(symptom_input, generation=None):
+    generation = generation or model_generation
+    
+    # Safety check
+    if generation is None:
+        raise ValueError("Model or required data not loaded")
+    
+    # Debug the input
+    logger.debug(f"Input symptoms: {symptom_input}")
+    
+    input_symptoms, active_indices, debug_info = vectorize_symptoms(generation, symptom_input)
+    logger.debug(f"Processed symptoms: {input_symptoms}")
+    logger.debug(f"Found {debug_info['symptoms_matched_count']}/{len(input_symptoms)} symptoms in model columns")
     
     # Create a binary vector where 1 means the symptom is present
-    input_vector = [1 if any(sym in symptom.lower() for sym in input_symptoms) else 0 for symptom in symptom_columns]
+    input_vector = np.zeros(generation.symptom_matcher.vector_length)
+    input_vector[list(active_indices)] = 1
+    logger.debug(f"Input vector has {len(active_indices)} non-zero features out of {len(input_vector)}")
     
-    # Count non-zero features for debug
-    nonzero_count = sum(input_vector)
-    logger.info(f"Input vector has {nonzero_count} non-zero features out of {len(input_vector)}")
+    # Identical symptom vectors always get the same prediction, so reuse a recent one
+    cached = generation.prediction_cache.get(active_indices)
+    if cached is not None:
+        logger.debug(f"Prediction cache hit - predicted disease: {cached[0]}")
+        predicted_disease, debug_info = apply_cached_prediction(cached, debug_info)
+    else:
+        predicted_disease, debug_info = predict_from_vector(generation, input_vector, input_symptoms, debug_info)
+        cache_prediction(generation, active_indices, predicted_disease, debug_info)
+    PREDICTIONS.labels(debug_info["prediction_method"]).inc()
+    return predicted_disease, debug_info
+
+def predict_from_vector(generation, input_vector, input_symptoms, debug_info):
+    model = generation.model
     
-    debug_info = {
-        "symptoms_input": symptom_input,
-        "symptoms_processed": input_symptoms,
-        "symptoms_matched_count": len(matched_symptoms),
-        "nonzero_features": nonzero_count,
-        "vector_length": len(input_vector),
-        "classes_count": len(le.classes_),
-        "estimators_count": len(model.estimators_),
-        "prediction_method": "unknown"
-    }
+    # Fast path: evaluate every tree at once with the compiled flat forest
+    if generation.flat_forest is not None:
+        try:
+            logger.debug("Attempting flat forest inference")
+            debug_info["prediction_method"] = "flat_forest"
+            
+            start = time.perf_counter()
+            proba, trees_used = flat_forest_proba(generation, input_vector)
+            pred_encoded = np.argmax(proba[0])
+            PREDICT_SECONDS.labels("flat_forest").observe(time.perf_counter() - start)
+            predicted_disease = decode_labels(generation, [pred_encoded])[0]
+            
+            logger.debug(f"Flat forest successful - predicted disease: {predicted_disease}")
+            debug_info["prediction_confidence"] = float(proba[0][pred_encoded])
+            debug_info["trees_used"] = int(trees_used[0])
+            return predicted_disease, debug_info
+        except Exception as e:
+            PREDICTION_FAILURES.labels("flat_forest").inc()
+            logger.warning(f"Flat forest inference failed: {str(e)}")
+    
+    # Without the sklearn model (flat artifact only) there is nothing else to try but symptom matching
+    if model is None:
+        return symptom_matching_fallback(generation, input_symptoms, debug_info)
     
     # First try: Use model's predict_proba if available
     try:
-        logger.info("Attempting method 1: model.predict_proba")
+        logger.debug("Attempting method 1: model.predict_proba")
         debug_info["prediction_method"] = "predict_proba"
         
+        start = time.perf_counter()
         proba = model.predict_proba([input_vector])
         pred_encoded = np.argmax(proba[0])
-        predicted_disease = le.inverse_transform([pred_encoded])[0]
+        PREDICT_SECONDS.labels("predict_proba").observe(time.perf_counter() - start)
+        predicted_disease = decode_labels(generation, [pred_encoded])[0]
         
-        logger.info(f"Method 1 successful - predicted disease: {predicted_disease}")
+        logger.debug(f"Method 1 successful - predicted disease: {predicted_disease}")
         debug_info["prediction_confidence"] = float(proba[0][pred_encoded])
         return predicted_disease, debug_info
     except Exception as e:
+        PREDICTION_FAILURES.labels("predict_proba").inc()
         logger.warning(f"Method 1 failed: {str(e)}")
 
     # Second try: Use direct predict
     try:
-        logger.info("Attempting method 2: model.predict")
+        logger.debug("Attempting method 2: model.predict")
         debug_info["prediction_method"] = "predict"
         
+        start = time.perf_counter()
         pred_encoded = model.predict([input_vector])[0]
-        predicted_disease = le.inverse_transform([pred_encoded])[0]
+        PREDICT_SECONDS.labels("predict").observe(time.perf_counter() - start)
+        predicted_disease = decode_labels(generation, [pred_encoded])[0]
         
-        logger.info(f"Method 2 successful - predicted disease: {predicted_disease}")
+        logger.debug(f"Method 2 successful - predicted disease: {predicted_disease}")
         return predicted_disease, debug_info
     except Exception as e:
+        PREDICTION_FAILURES.labels("predict").inc()
         logger.warning(f"Method 2 failed: {str(e)}")
 
     # Third try: Manual voting system
     try:
-        logger.info("Attempting method 3: manual voting")
+        logger.debug("Attempting method 3: manual voting")
         debug_info["prediction_method"] = "manual_voting"
         
+        start = time.perf_counter()
         class_votes = {}
         # Loop through each tree and collect its vote
         for tree in model.estimators_:
@@ -229,20 +1143,23 @@ def predict_disease_from_symptoms(symptom_input):
         
         # Get the class with most votes and its count
         pred_encoded, vote_count = max(class_votes.items(), key=lambda x: x[1])
-        predicted_disease = le.inverse_transform([pred_encoded])[0]
+        PREDICT_SECONDS.labels("manual_voting").observe(time.perf_counter() - start)
+        predicted_disease = decode_labels(generation, [pred_encoded])[0]
         
-        logger.info(f"Method 3 successful - predicted disease: {predicted_disease} with {vote_count} votes")
+        logger.debug(f"Method 3 successful - predicted disease: {predicted_disease} with {vote_count} votes")
         debug_info["votes"] = vote_count
         debug_info["total_trees"] = len(model.estimators_)
         return predicted_disease, debug_info
     except Exception as e:
+        PREDICTION_FAILURES.labels("manual_voting").inc()
         logger.warning(f"Method 3 failed: {str(e)}")
     
     # Last Resort: Try a different manual approach
     try:
-        logger.info("Attempting method 4: tree-by-tree")
+        logger.debug("Attempting method 4: tree-by-tree")
         debug_info["prediction_method"] = "tree_by_tree"
         
+        start = time.perf_counter()
         predictions = []
         for idx, estimator in enumerate(model.estimators_):
             try:
@@ -255,138 +1172,482 @@ def predict_disease_from_symptoms(symptom_input):
         if not predictions:
             raise ValueError("No successful tree predictions")
             
-        from collections import Counter
         most_common = Counter(predictions).most_common(1)
         pred_encoded = most_common[0][0]
-        predicted_disease = le.inverse_transform([pred_encoded])[0]
+        PREDICT_SECONDS.labels("tree_by_tree").observe(time.perf_counter() - start)
+        predicted_disease = decode_labels(generation, [pred_encoded])[0]
         
-        logger.info(f"Method 4 successful - predicted disease: {predicted_disease}")
+        logger.debug(f"Method 4 successful - predicted disease: {predicted_disease}")
         debug_info["successful_trees"] = len(predictions)
         return predicted_disease, debug_info
     except Exception as e:
+        PREDICTION_FAILURES.labels("tree_by_tree").inc()
         logger.error(f"Method 4 failed: {str(e)}")
     
+    return symptom_matching_fallback(generation, input_symptoms, debug_info)
+
+def symptom_matching_fallback(generation, input_symptoms, debug_info):
     # Ultimate fallback - check if any symptoms exist in the dataset
     logger.warning("All prediction methods failed, falling back to symptom matching")
     debug_info["prediction_method"] = "symptom_matching_fallback"
     
     try:
-        # Let's try loading the original training data
-        data_dir = os.environ.get("DATA_DIR", "./data")
-        symptoms_path = os.path.join(data_dir, "Disease and symptoms dataset.csv")
-        
-        if os.path.exists(symptoms_path):
-            df = pd.read_csv(symptoms_path)
-            logger.info(f"Loaded original dataset with {len(df)} rows")
-            
-            # Find rows with matching symptoms
-            matches = []
-            for symptom in input_symptoms:
-                # Check if any column contains this symptom
-                for col in df.columns:
-                    if col != 'diseases' and symptom in str(col).lower():
-                        # Found a column that matches this symptom
-                        matched_rows = df[df[col] == 1]
-                        if not matched_rows.empty:
-                            matches.extend(matched_rows['diseases'].tolist())
+        if generation.symptom_disease_index is not None:
+            start = time.perf_counter()
+            # Weight each matching column by how many input symptoms hit it, then sum its disease counts
+            col_idxs, weights = generation.symptom_matcher.column_hits(input_symptoms)
+            scores = generation.symptom_disease_index[col_idxs].T @ weights
+            matched_count = int(scores.sum())
+            PREDICT_SECONDS.labels("symptom_matching_fallback").observe(time.perf_counter() - start)
             
-            if matches:
+            if matched_count > 0:
                 # Return the most common disease among matches
-                most_common = Counter(matches).most_common(1)[0][0]
-                logger.info(f"Found matching disease by symptom lookup: {most_common}")
-                debug_info["matched_count"] = len(matches)
+                most_common = generation.le.classes_[int(np.argmax(scores))]
+                logger.debug(f"Found matching disease by symptom lookup: {most_common}")
+                debug_info["matched_count"] = matched_count
                 return most_common, debug_info
     except Exception as e:
+        PREDICTION_FAILURES.labels("symptom_matching_fallback").inc()
         logger.error(f"Symptom matching fallback failed: {str(e)}")
     
     # Final fallback - totally generic response
     logger.error("All methods failed - returning generic response")
     return "General Health Issue", debug_info
 
-def get_doctors_by_disease(disease_name):
-    global diseases_df, faculty_df
-    
-    # Safety check
-    if diseases_df is None or faculty_df is None:
-        raise ValueError("Required data not loaded")
-        
-    logger.info(f"Finding doctors for disease: {disease_name}")
+def sample_doctors(generation, disease_name):
+    # Returns the lowercased department and the positions of up to 3 of its doctors, randomly selected
+    logger.debug(f"Finding doctors for disease: {disease_name}")
     # Make sure we match case-insensitive
-    disease_row = diseases_df[diseases_df['Diseases'].str.strip().str.lower() == disease_name.lower()]
+    department = generation.disease_departments.get(disease_name.lower())
     
-    if disease_row.empty:
+    if department is None:
         logger.warning(f"No department found for disease '{disease_name}', defaulting to 'Medicine'")
         department = "Medicine"
     else:
-        department = disease_row.iloc[0]['Department'].strip()
-        logger.info(f"Found department: {department}")
+        logger.debug(f"Found department: {department}")
     
     # Match department in faculty, case-insensitive
-    doctors = faculty_df[faculty_df['Department'].str.lower() == department.lower()]
+    department = department.lower()
+    doctors = generation.department_doctors.get(department, ())
     
-    if doctors.empty:
+    if not doctors:
         logger.warning(f"No doctors found in department: {department}")
-        return []
+        return department, []
+    
+    return department, random.sample(range(len(doctors)), min(3, len(doctors)))
+
+def get_doctors_by_disease(disease_name, generation=None):
+    generation = generation or model_generation
+    
+    # Safety check
+    if generation is None:
+        raise ValueError("Required data not loaded")
     
-    # Return up to 3 doctors (randomly selected)
-    selected_doctors = doctors.sample(min(3, len(doctors)))
-    return selected_doctors[['Name', 'Designation', 'Department']].to_dict(orient='records')  # type: ignore
+    # Copied so callers can't alter the index
+    department, picks = sample_doctors(generation, disease_name)
+    return [dict(generation.department_doctors[department][idx]) for idx in picks]
+
+
+def create_inference_executor():
+    if INFERENCE_EXECUTOR == "process":
+        logger.info(f"Running inference on {INFERENCE_WORKERS} worker processes (queue size {INFERENCE_QUEUE_SIZE})")
+        return ProcessPoolExecutor(max_workers=INFERENCE_WORKERS, initializer=init_inference_process)
+    logger.info(f"Running inference on {INFERENCE_WORKERS} worker threads (queue size {INFERENCE_QUEUE_SIZE})")
+    return ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+
+def init_inference_process():
+    # Forked workers inherit the loaded generation; spawned ones load their own (mapping the flat artifact if present)
+    if not forest_loaded():
+        asyncio.run(load_model())
+    # Forked workers also inherit the parent's counters, and a spawned one has just counted its own load. Only
+    # what this process records from here on belongs in the deltas run_with_metrics sends back for merging.
+    REGISTRY.drain()
+
+async def run_inference(fn, *args):
+    # Fail fast instead of queueing without bound, so latency stays predictable under load
+    global inference_in_flight
+    if inference_in_flight >= INFERENCE_WORKERS + INFERENCE_QUEUE_SIZE:
+        INFERENCE_REJECTED.inc()
+        logger.warning(f"Inference queue full ({inference_in_flight} requests in flight), rejecting request")
+        raise HTTPException(
+            status_code=503,
+            detail="Inference queue is full, please retry later",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    
+    inference_in_flight += 1
+    try:
+        if INFERENCE_EXECUTOR == "process":
+            result, drained_metrics = await asyncio.get_running_loop().run_in_executor(inference_executor, run_with_metrics, fn, *args)
+            REGISTRY.merge(drained_metrics)
+            return result
+        return await asyncio.get_running_loop().run_in_executor(inference_executor, fn, *args)
+    finally:
+        inference_in_flight -= 1
+
+def run_with_metrics(fn, *args):
+    # Runs in an inference worker process, whose metrics would otherwise never reach /metrics:
+    # everything recorded since its last task goes back with the result and is merged by the parent
+    result = fn(*args)
+    return result, REGISTRY.drain()
+
+class MicroBatcher:
+    # Collects /recommend calls on the event loop and runs them as one recommend_for_symptoms_batch call once
+    # the window since the first waiting call has passed or max_size calls are waiting.
+    # Each caller awaits its own future, resolved with its row of the batch.
+    def __init__(self, window_ms, max_size):
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._pending = []
+        self._flush_handle = None
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+    
+    async def submit(self, symptoms, include_debug=False):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((symptoms, include_debug, future))
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self.flush)
+        return await future
+    
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+    
+    async def _run(self, batch):
+        self.batches += 1
+        self.requests += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            results = await run_inference(recommend_for_symptoms_batch, [symptoms for symptoms, _, _ in batch],
+                                          [include_debug for _, include_debug, _ in batch])
+        except Exception as e:
+            # Every caller in the batch gets the error, including a 503 from a full inference queue
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), result in zip(batch, results):
+            # Callers that disconnected have cancelled their future
+            if not future.done():
+                future.set_result(result)
+    
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for _, _, future in self._pending:
+            if not future.done():
+                future.cancel()
+        self._pending = []
+    
+    def stats(self):
+        return {
+            "window_ms": self.window * 1000,
+            "max_size": self.max_size,
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch
+        }
+
+def recommend_for_symptoms(symptoms, include_debug=False):
+    # The whole request uses the generation current when it started, even if a reload swaps it meanwhile
+    generation = model_generation
+    predicted_disease, debug_info = predict_disease_from_symptoms(symptoms, generation)
+    return build_recommendation(generation, predicted_disease, debug_info, include_debug)
+
+def recommend_for_symptoms_batch(symptoms_list, include_debug=False):
+    # Predict the whole batch at once, then fan the doctor lookups back out per case.
+    # include_debug is one flag for the batch or, for a micro-batch of separate callers, one per case.
+    generation = model_generation
+    predictions = predict_diseases_batch(symptoms_list, generation)
+    if isinstance(include_debug, bool):
+        include_debug = [include_debug] * len(predictions)
+    return [build_recommendation(generation, predicted_disease, debug_info, debug)
+            for (predicted_disease, debug_info), debug in zip(predictions, include_debug)]
+
+def read_upload_rows(upload, upload_format, column):
+    # Yields (id, symptoms, error) for each record of an NDJSON or CSV upload, reading one record at a time.
+    # NDJSON lines are objects with a `column` field (and optionally "id") or bare strings; CSV needs a header row.
+    text = io.TextIOWrapper(upload, encoding="utf-8", newline="")
+    if upload_format == "csv":
+        reader = csv.DictReader(text)
+        if reader.fieldnames is None or column not in reader.fieldnames:
+            raise ValueError(f"CSV upload has no '{column}' column")
+        for record in reader:
+            yield record.get("id"), record.get(column), None
+        return
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield None, None, "Invalid JSON"
+            continue
+        if isinstance(record, dict):
+            yield record.get("id"), record.get(column), None
+        else:
+            yield None, record, None
+
+def chunk_upload_rows(rows, chunk_size):
+    # Groups records into lists of (row number, id, symptoms, error), validating symptoms on the way
+    chunk = []
+    for row, (record_id, symptoms, error) in enumerate(rows):
+        if error is None and not isinstance(symptoms, str):
+            error = "Symptoms must be a string"
+        elif error is None and symptoms.strip() == "":
+            error = "Symptoms cannot be empty"
+        chunk.append((row, record_id, symptoms, error))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def recommend_stream_chunk(chunk, include_debug=False):
+    # Runs on the inference pool: predicts the valid rows of a chunk together and returns their NDJSON lines
+    # in upload order, with an error line for each invalid row
+    valid = [(row, record_id, symptoms) for row, record_id, symptoms, error in chunk if error is None]
+    recommendations = iter(recommend_for_symptoms_batch([symptoms for _, _, symptoms in valid], include_debug) if valid else [])
+    lines = []
+    for row, record_id, symptoms, error in chunk:
+        result = {"row": row}
+        if record_id is not None:
+            result["id"] = record_id
+        if error is None:
+            # Splice the already serialized recommendation's fields in after row and id
+            lines.append(dump_json(result)[:-1] + b"," + next(recommendations)[1:])
+        else:
+            result["error"] = error
+            lines.append(dump_json(result))
+    STREAM_ROWS.labels("ok").inc(len(valid))
+    STREAM_ROWS.labels("error").inc(len(chunk) - len(valid))
+    return b"\n".join(lines) + b"\n"
+
+async def next_upload_chunk(chunks):
+    # Reading and parsing a chunk of the spooled upload is blocking work, so it runs on the default thread pool
+    # rather than the event loop; chunks are still pulled one at a time, in order
+    return await asyncio.get_running_loop().run_in_executor(None, next, chunks, None)
+
+async def run_stream_chunk(chunk, include_debug):
+    # A bulk job yields to interactive traffic: when the inference queue is full it waits and retries
+    # instead of failing the rest of the stream
+    while True:
+        try:
+            return await run_inference(recommend_stream_chunk, chunk, include_debug)
+        except HTTPException as e:
+            if e.status_code != 503:
+                raise
+            await asyncio.sleep(RETRY_AFTER_SECONDS)
+
+def build_recommendation(generation, predicted_disease, debug_info, include_debug=False):
+    # Returns the recommendation as JSON bytes, spliced together from the pre-serialized doctor records;
+    # only the disease name (and debug_info when asked for) is encoded per request
+    start = time.perf_counter()
+    department, picks = sample_doctors(generation, predicted_disease)
+    doctors = [generation.department_doctors_json[department][idx] for idx in picks]
+    DOCTOR_LOOKUP_SECONDS.observe(time.perf_counter() - start)
+    
+    # If no doctors found, provide some default options
+    if not doctors:
+        logger.warning(f"No doctors found for disease '{predicted_disease}', using defaults")
+        doctors = DEFAULT_DOCTORS_JSON
+    
+    parts = [b'{"predicted_disease":', dump_json(predicted_disease), b',"doctors":[', b",".join(doctors), b"]"]
+    if include_debug:
+        parts += [b',"debug_info":', dump_json(debug_info)]
+    parts.append(b"}")
+    return b"".join(parts)
 
 
 @app.get("/")
 async def root():
+    generation = model_generation
     return {
         "message": "Doctor Recommendation API is running",
-        "model_loaded": model is not None,
-        "symptom_count": len(symptom_columns) if symptom_columns is not None else 0,
-        "classes_count": len(le.classes_) if le is not None else 0,
-        "model_estimators": len(model.estimators_) if model is not None and hasattr(model, 'estimators_') else 0,
-        "sample_symptoms": list(symptom_columns)[:5] if symptom_columns is not None else []
+        "model_loaded": generation is not None,
+        "model_generation": generation.number if generation is not None else None,
+        "reload_in_progress": reload_in_progress,
+        "symptom_count": len(generation.symptom_columns) if generation is not None else 0,
+        "classes_count": len(generation.le.classes_) if generation is not None else 0,
+        "model_estimators": generation.estimators_count() if generation is not None else 0,
+        "forest_engine": "flat" if generation is not None and generation.flat_forest is not None else "sklearn",
+        "early_exit": EARLY_EXIT == "on" and generation is not None and generation.flat_forest is not None,
+        "prediction_cache": generation.prediction_cache.stats() if generation is not None else None,
+        "inference": {
+            "executor": INFERENCE_EXECUTOR,
+            "workers": INFERENCE_WORKERS,
+            "in_flight": inference_in_flight,
+            "capacity": INFERENCE_WORKERS + INFERENCE_QUEUE_SIZE
+        },
+        "micro_batching": request_batcher.stats() if request_batcher is not None else None,
+        "sample_symptoms": list(generation.symptom_columns)[:5] if generation is not None else []
     }
 
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/symptoms")
-async def list_symptoms():
-    if symptom_columns is None:
+async def list_symptoms(if_none_match: str = Header(default="")):
+    generation = model_generation
+    if generation is None:
         raise HTTPException(status_code=500, detail="Model not loaded")
     
+    # Clients revalidate on every use and get an empty 304 while the list is unchanged
+    headers = {"ETag": generation.symptoms_etag, "Cache-Control": "no-cache"}
+    if if_none_match and etag_matches(if_none_match, generation.symptoms_etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=generation.symptoms_json, media_type="application/json", headers=headers)
+
+@app.get("/symptoms/suggest")
+async def suggest_symptoms(q: str, limit: int = 10):
+    if model_generation is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    
+    if limit < 1 or limit > SUGGEST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {SUGGEST_MAX_LIMIT}")
+    
+    return {
+        "query": q,
+        "suggestions": model_generation.symptom_suggester.suggest(q, limit)
+    }
+
+@app.post("/admin/reload")
+async def admin_reload(x_admin_token: str = Header(default="")):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+    if model_generation is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    
+    try:
+        generation = await reload_model("requested through /admin/reload")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Model reload failed, generation {model_generation.number} is still being served: {str(e)}")
+    
     return {
-        "symptoms": list(symptom_columns)
+        "message": "Model reloaded",
+        "generation": generation.describe()
     }
 
 @app.post("/recommend")
-async def recommend_doctors(request: SymptomRequest):
-    if model is None or le is None or symptom_columns is None or diseases_df is None or faculty_df is None:
+async def recommend_doctors(request: SymptomRequest, debug: bool = False):
+    if not forest_loaded():
         raise HTTPException(status_code=500, detail="Model or data not loaded")
     
     if not request.symptoms or request.symptoms.strip() == "":
         raise HTTPException(status_code=400, detail="Symptoms cannot be empty")
     
     try:
-        # Predict disease with debug info
-        predicted_disease, debug_info = predict_disease_from_symptoms(request.symptoms)
-        
-        # Get doctor recommendations
-        doctors = get_doctors_by_disease(predicted_disease)
-        
-        # If no doctors found, provide some default options
-        if not doctors:
-            logger.warning(f"No doctors found for disease '{predicted_disease}', using defaults")
-            doctors = [
-                {"Name": "Dr. General Medicine", "Designation": "General Physician", "Department": "Medicine"}
-            ]
-        
-        return {
-            "predicted_disease": predicted_disease,
-            "doctors": doctors,
-            "debug_info": debug_info
-        }
+        # Predict disease on the inference pool, keeping the event loop free; the body comes back already serialized
+        if request_batcher is not None:
+            content = await request_batcher.submit(request.symptoms, debug)
+        else:
+            content = await run_inference(recommend_for_symptoms, request.symptoms, debug)
+        return Response(content=content, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_details = f"Error processing request: {str(e)}\n{traceback.format_exc()}"
         logger.error(error_details)
         raise HTTPException(status_code=500, detail=error_details)
 
+@app.post("/recommend/stream")
+async def recommend_doctors_stream(request: Request, format: str = None, column: str = "symptoms", debug: bool = False):
+    if not forest_loaded():
+        raise HTTPException(status_code=500, detail="Model or data not loaded")
+    
+    upload_format = format or STREAM_FORMATS.get(request.headers.get("content-type", "").split(";")[0].strip().lower())
+    if upload_format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=415, detail="Upload NDJSON (application/x-ndjson) or CSV (text/csv), or pass ?format=ndjson|csv")
+    
+    too_large = HTTPException(status_code=413, detail=f"Upload exceeds the limit of {STREAM_MAX_BYTES} bytes")
+    content_length = request.headers.get("content-length", "")
+    if STREAM_MAX_BYTES > 0 and content_length.isdigit() and int(content_length) > STREAM_MAX_BYTES:
+        raise too_large
+    
+    # Buffer the upload (on disk past STREAM_SPOOL_BYTES) before responding; some ASGI servers can't deliver
+    # request body chunks while a streaming response is being sent. Chunked uploads carry no length, so the
+    # limit is also enforced while reading.
+    upload = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_BYTES)
+    try:
+        received = 0
+        async for block in request.stream():
+            received += len(block)
+            if STREAM_MAX_BYTES > 0 and received > STREAM_MAX_BYTES:
+                raise too_large
+            upload.write(block)
+        upload.seek(0)
+        chunks = chunk_upload_rows(read_upload_rows(upload, upload_format, column), STREAM_CHUNK_SIZE)
+        # The first chunk is predicted up front, so a bad header or a full queue still gets a proper status code
+        first_chunk = await next_upload_chunk(chunks)
+        first_lines = await run_inference(recommend_stream_chunk, first_chunk, debug) if first_chunk else b""
+    except (ValueError, csv.Error) as e:
+        upload.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        upload.close()
+        raise
+    
+    async def stream_results():
+        try:
+            yield first_lines
+            while (chunk := await next_upload_chunk(chunks)) is not None:
+                yield await run_stream_chunk(chunk, debug)
+        except (ValueError, csv.Error) as e:
+            # Malformed data further into the upload (e.g. invalid UTF-8 or an oversized CSV field) ends the stream with an error line
+            logger.warning(f"Stopping /recommend/stream: {str(e)}")
+            yield dump_json({"error": str(e)}) + b"\n"
+        finally:
+            upload.close()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/recommend/batch")
+async def recommend_doctors_batch(request: BatchSymptomRequest, debug: bool = False):
+    if not forest_loaded():
+        raise HTTPException(status_code=500, detail="Model or data not loaded")
+    
+    if not request.symptoms:
+        raise HTTPException(status_code=400, detail="Symptoms list cannot be empty")
+    
+    if len(request.symptoms) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch size exceeds the limit of {MAX_BATCH_SIZE} cases")
+    
+    empty = [idx for idx, symptoms in enumerate(request.symptoms) if not symptoms or symptoms.strip() == ""]
+    if empty:
+        raise HTTPException(status_code=400, detail=f"Symptoms cannot be empty (cases {empty[:10]})")
+    
+    try:
+        results = await run_inference(recommend_for_symptoms_batch, request.symptoms, debug)
+        return Response(content=b'{"results":[' + b",".join(results) + b"]}", media_type="application/json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        error_details = f"Error processing batch request: {str(e)}\n{traceback.format_exc()}"
+        logger.error(error_details)
+        raise HTTPException(status_code=500, detail=error_details)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False)
+    if WORKERS > 1:
+        # Export once in the parent so every worker memory-maps one shared copy of the forest
+        ensure_flat_artifact()
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=False, workers=WORKERS)
     
@@ -0,0 +1,252 @@
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Minimal Prometheus-style metrics (counters, gauges, histograms) rendered in the text exposition format.
+# The API mirrors prometheus_client (metric.labels(...).inc()/set()/observe()) without the dependency.
+
+# Seconds, from 10 µs (a cached prediction stage) up to 10 s (a request stuck behind a full queue)
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    return repr(float(value))
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # A later definition replaces an earlier one: `python main.py` executes main.py once as __main__ and
+        # again when uvicorn imports main:app, and only the second module serves requests
+        self._metrics[metric.name] = metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def drain(self):
+        # Counter and histogram values recorded since the last drain, reset to zero. A worker process
+        # returns these with each result so its parent can merge them into the registry it serves.
+        return {name: metric.drain() for name, metric in self._metrics.items() if metric.mergeable}
+
+    def merge(self, drained):
+        for name, children in drained.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(children)
+
+
+REGISTRY = Registry()
+
+# Threads inside recording_paused() don't record counters or histograms, e.g. while warming up a model
+_paused = threading.local()
+
+
+@contextmanager
+def recording_paused():
+    previous = getattr(_paused, "active", False)
+    _paused.active = True
+    try:
+        yield
+    finally:
+        _paused.active = previous
+
+
+def recording():
+    return not getattr(_paused, "active", False)
+
+
+class CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if not recording():
+            return
+        with self._lock:
+            self.value += amount
+
+    def drain(self):
+        with self._lock:
+            value, self.value = self.value, 0.0
+        return value
+
+    def merge(self, value):
+        with self._lock:
+            self.value += value
+
+
+class GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = float(value)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Per-bucket (not cumulative) counts; the last slot is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not recording():
+            return
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+
+    def drain(self):
+        with self._lock:
+            drained = (self.counts, self.sum)
+            self.counts, self.sum = [0] * (len(self.buckets) + 1), 0.0
+        return drained
+
+    def merge(self, drained):
+        counts, total = drained
+        with self._lock:
+            self.counts = [own + other for own, other in zip(self.counts, counts)]
+            self.sum += total
+
+
+class Metric:
+    kind = "untyped"
+    mergeable = False
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._function = None
+        self._lock = threading.Lock()
+        registry.register(self)
+        # Unlabelled metrics are exported as 0 from the start rather than appearing on first use
+        if not self.labelnames:
+            self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def set_function(self, function):
+        # Computed at scrape time instead of recorded: function returns a number, or for a labelled
+        # metric a dict mapping label value tuples to numbers
+        self._function = function
+
+    def samples(self):
+        # (name suffix, label names, label values, value) for every series
+        if self._function is not None:
+            values = self._function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [("", self.labelnames, key, value) for key, value in values.items()]
+        return [("", self.labelnames, key, child.value) for key, child in list(self._children.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, key, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(names, key)} {format_value(value)}")
+        return lines
+
+    def drain(self):
+        return {key: child.drain() for key, child in list(self._children.items())}
+
+    def merge(self, children):
+        for key, drained in children.items():
+            self.labels(*key).merge(drained)
+
+
+class Counter(Metric):
+    kind = "counter"
+    mergeable = True
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    mergeable = True
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        samples = []
+        bucket_names = self.labelnames + ("le",)
+        bounds = [format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                samples.append(("_bucket", bucket_names, key + (bound,), cumulative))
+            samples.append(("_sum", self.labelnames, key, total))
+            samples.append(("_count", self.labelnames, key, cumulative))
+        return samples
@@ -1,191 +1,563 @@
-import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.tree._tree import Tree
 from sklearn.preprocessing import LabelEncoder
+from scipy import sparse
+from packed_dataset import ensure_packed, packed_paths, source_signature
+import pandas as pd
+import argparse
+import glob
+import hashlib
+import io
+import json
 import os
+import re
 import pickle
 import psutil
 import time
 import gc
-import sys
 from joblib import Parallel, delayed, effective_n_jobs
 
+# Paths to data files
+data_dir = "./data"
+symptoms_path = os.path.join(data_dir, "Disease and symptoms dataset.csv")
+packed_prefix = os.path.join(data_dir, "symptom_dataset")
+
+n_estimators_total = 200
+
+# Checkpoints written during training; bumped whenever their content changes
+checkpoint_pattern = os.path.join(data_dir, "rf_model_temp_{}trees.pkl")
+checkpoint_format_version = 3
+
+# How far into the CSV the saved model has been trained, so --mode incremental reads only rows appended since
+manifest_path = os.path.join(data_dir, "training_manifest.json")
+manifest_format_version = 1
+label_column = "diseases"
+
 # Function to monitor and print memory usage
 def print_memory_usage():
     memory_usage = psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
     print(f"Current memory usage: {memory_usage:.2f} MB")
 
-print("Starting ultra memory-efficient model training...")
-print_memory_usage()
+# CPU and memory limits; train_with_limits.sh exports its limits so they apply inside the script too
+def resource_limits():
+    cpu_percent = float(os.environ.get("TRAIN_MAX_CPU_PERCENT", 30))
+    n_jobs = max(1, int(psutil.cpu_count() * cpu_percent / 100))
+    available_memory = psutil.virtual_memory().available / (1024 * 1024)  # in MB
+    memory_budget = available_memory * 0.5  # Target using only 50% of available memory
+    if "TRAIN_MAX_MEMORY_MB" in os.environ:
+        memory_budget = min(memory_budget, float(os.environ["TRAIN_MAX_MEMORY_MB"]) * 0.8)
+    return n_jobs, available_memory, memory_budget
 
-# Set CPU and memory limits
-n_jobs = max(1, int(psutil.cpu_count() * 0.3))  # Use 30% of cores
-print(f"Using {n_jobs} CPU cores for training")
+def load_dataset():
+    # Convert the CSV once into the bit-packed format; later runs read it directly without text parsing
+    print("Loading packed dataset...")
+    dataset = ensure_packed(symptoms_path, packed_prefix)
+    print(f"Dataset has {dataset.n_rows} rows, {dataset.n_features} symptom columns and {len(dataset.classes)} disease labels")
+    print_memory_usage()
+    return dataset
 
-# Paths to data files
-data_dir = "./data"
-symptoms_path = os.path.join(data_dir, "Disease and symptoms dataset.csv")
+def save_symptom_index(dataset):
+    # Save the symptom -> disease co-occurrence index (symptoms x encoded classes) used by the API's fallback
+    print("Saving symptom-disease index...")
+    symptom_index = dataset.class_symptom_counts().T.astype(np.int32)
+    sparse.save_npz(os.path.join(data_dir, "symptom_disease_index.npz"), sparse.csr_matrix(symptom_index))
+
+# Wrap fitted trees in a RandomForestClassifier shell that predict_proba and the API understand
+def assemble_forest(estimators, n_features, n_classes):
+    model = RandomForestClassifier(n_estimators=1, random_state=42)
+    model.fit(np.zeros((1, n_features)), np.zeros(1))
+    model.estimators_ = estimators
+    model.n_estimators = len(estimators)
+    # Every tree was fit on the full encoded label set, so forest columns are the encoded classes
+    model.classes_ = np.arange(n_classes)
+    model.n_classes_ = n_classes
+    return model
+
+def save_outputs(model, le, symptom_columns):
+    # Save model and encoder to pickle files
+    print("Saving final model and data to pickle files...")
+    pickle.dump(model, open(os.path.join(data_dir, "optimized_rf_model.pkl"), "wb"))
+    pickle.dump(le, open(os.path.join(data_dir, "label_encoder.pkl"), "wb"))
+    pickle.dump(list(symptom_columns), open(os.path.join(data_dir, "symptom_columns.pkl"), "wb"))
+
+def csv_tail_digest(offset, length=65536):
+    # Hash of the bytes just before offset, to tell a CSV that was appended to from one that was rewritten
+    start = max(0, offset - length)
+    with open(symptoms_path, "rb") as f:
+        f.seek(start)
+        return hashlib.sha256(f.read(offset - start)).hexdigest()
+
+def write_manifest(csv_rows, csv_offset, trees_trained, history):
+    manifest = {
+        "format_version": manifest_format_version,
+        "csv_rows": csv_rows,
+        "csv_offset": csv_offset,
+        "csv_tail_sha256": csv_tail_digest(csv_offset),
+        "trees_trained": trees_trained,
+        "history": history,
+    }
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def record_full_training(dataset, trees_trained):
+    # A full run trained on every row of the packed dataset; incremental runs continue from the end of its CSV
+    if not os.path.exists(symptoms_path) or dataset.source != source_signature(symptoms_path):
+        print("Not writing a training manifest: the packed dataset no longer matches the CSV")
+        return
+    write_manifest(dataset.n_rows, dataset.source["size"], trees_trained, [])
+
+def load_manifest():
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") == manifest_format_version:
+            return manifest
+        print(f"Ignoring {manifest_path} written by an older version of this script")
+    # Models trained before manifests existed: the packed dataset records how much of the CSV went into them
+    header_path = packed_paths(packed_prefix)["header"]
+    if os.path.exists(header_path):
+        with open(header_path) as f:
+            header = json.load(f)
+        print(f"No training manifest, assuming the model was trained on the {header['n_rows']} rows of the packed dataset")
+        return {"csv_rows": header["n_rows"], "csv_offset": header["source"]["size"], "csv_tail_sha256": None,
+                "trees_trained": None, "history": []}
+    return None
+
+def list_checkpoints():
+    # (trees_trained, path) pairs, oldest first
+    checkpoints = []
+    for path in glob.glob(checkpoint_pattern.format("*")):
+        match = re.search(r"rf_model_temp_(\d+)trees\.pkl$", path)
+        if match:
+            checkpoints.append((int(match.group(1)), path))
+    return sorted(checkpoints)
+
+def save_checkpoint(state, le, dataset, keep_checkpoints):
+    # --keep-checkpoints 0 turns checkpoints off
+    if keep_checkpoints <= 0:
+        return
+    symptom_columns = dataset.columns
+    trees_trained = state["trees_trained"]
+    print(f"Saving intermediate model with {trees_trained} trees...")
+    path = checkpoint_pattern.format(trees_trained)
+    state = {**state, "format_version": checkpoint_format_version,
+             "classes": list(le.classes_), "columns": list(symptom_columns), "source": dataset.source}
+
+    # Write to a temporary file and rename, so a kill mid-write never leaves a truncated checkpoint
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(state, f)
+    os.replace(path + ".tmp", path)
+    pickle.dump(le, open(os.path.join(data_dir, "label_encoder.pkl"), "wb"))
+    pickle.dump(list(symptom_columns), open(os.path.join(data_dir, "symptom_columns.pkl"), "wb"))
+
+    # Prune older checkpoints
+    checkpoints = list_checkpoints()
+    for _, old_path in checkpoints[:len(checkpoints) - keep_checkpoints]:
+        os.remove(old_path)
+    print(f"Intermediate model saved with {trees_trained} trees")
+
+def remove_checkpoints():
+    # A finished run's checkpoints must not be resumed by a later run
+    for _, path in list_checkpoints():
+        os.remove(path)
+
+def load_latest_checkpoint(mode, le, dataset):
+    # Newest readable checkpoint from this mode, verified against the dataset's labels, columns and source CSV
+    for trees_trained, path in reversed(list_checkpoints()):
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except Exception as e:
+            print(f"Skipping unreadable checkpoint {path}: {str(e)}")
+            continue
+        if not isinstance(state, dict) or state.get("format_version") != checkpoint_format_version:
+            print(f"Skipping checkpoint {path} written by an older version of this script")
+            continue
+        if state["mode"] != mode:
+            print(f"Error: checkpoint {path} was written in {state['mode']} mode, not {mode}")
+            exit(1)
+        if state["classes"] != list(le.classes_) or state["columns"] != list(dataset.columns):
+            print(f"Error: checkpoint {path} was trained with different disease labels or symptom columns")
+            exit(1)
+        if state["source"] != dataset.source:
+            print(f"Error: checkpoint {path} was trained on a different version of the CSV; train without --resume")
+            exit(1)
+        print(f"Resuming from checkpoint {path} with {state['trees_trained']} trees")
+        return state
+    print("No usable checkpoint found, starting from scratch")
+    return None
+
+# Fit one tree on a bootstrap sample of a chunk. As in fit_bootstrap_tree, the first row of every class is added
+# with zero weight, so the tree's classes are the encoder's codes even when the chunk lacks some diseases.
+def train_tree(X, y, class_X, class_y, tree_idx):
+    rng = np.random.RandomState(42 + tree_idx)
+    weights = np.bincount(rng.randint(0, len(y), len(y)), minlength=len(y)).astype(np.float64)
+    tree = DecisionTreeClassifier(max_features="sqrt", class_weight="balanced",
+                                  random_state=rng.randint(np.iinfo(np.int32).max))
+    tree.fit(np.vstack([X, class_X]), np.concatenate([y, class_y]),
+             sample_weight=np.concatenate([weights, np.zeros(len(class_y))]))
+    return tree
+
+def train_chunked(args):
+    n_jobs, available_memory, _ = resource_limits()
+    print(f"Using {n_jobs} CPU cores for training")
+
+    dataset = load_dataset()
+    symptom_columns = dataset.columns
+    total_rows = dataset.n_rows
+
+    # Determine optimal chunk size based on available memory
+    print(f"Available memory: {available_memory:.2f} MB")
+
+    # Target using only 50% of available memory
+    memory_target = available_memory * 0.5
+    estimated_row_size = 0.5  # MB per 1000 rows - adjust based on observations
+    chunk_size = int((memory_target / estimated_row_size) * 1000)
+    chunk_size = min(chunk_size, 10000)  # Cap at 10,000 rows per chunk
+    print(f"Using chunk size of {chunk_size} rows")
+
+    # Labels are already encoded in the packed dataset
+    le = dataset.label_encoder()
+
+    # First row of every class, added to each tree's chunk with zero weight
+    class_rows = np.unique(np.asarray(dataset.labels), return_index=True)[1]
+    class_X, class_y = dataset.rows(np.sort(class_rows)), np.asarray(dataset.labels[np.sort(class_rows)])
+
+    save_symptom_index(dataset)
+    print_memory_usage()
+
+    # Train the model incrementally
+    print("Training Random Forest model incrementally...")
+    start_time = time.time()
+
+    trees_per_chunk = 2
+
+    # Incrementally train the model
+    trees_trained = 0
+    chunks_processed = 0
+    new_estimators = []
+
+    # Pick up where an interrupted run stopped: same trees, chunk position and chunk size
+    checkpoint = load_latest_checkpoint("chunked", le, dataset) if args.resume else None
+    if checkpoint is not None:
+        new_estimators = list(checkpoint["model"].estimators_)
+        trees_trained = checkpoint["trees_trained"]
+        chunks_processed = checkpoint["chunks_processed"]
+        chunk_size = checkpoint["chunk_size"]
+
+    total_chunks = (total_rows + chunk_size - 1) // chunk_size
+
+    while trees_trained < n_estimators_total:
+        print(f"\nTraining batch {trees_trained//trees_per_chunk + 1}/{n_estimators_total//trees_per_chunk}...")
+
+        # Process each chunk, starting mid-pass when resuming
+        for i, (X_chunk, y_chunk) in enumerate(dataset.iter_chunks(chunk_size, start_chunk=chunks_processed % total_chunks)):
+            chunks_processed += 1
+            print(f"Processing chunk {chunks_processed}/{total_chunks}...")
+
+            # Train trees for this chunk
+            trees_before_chunk = trees_trained
+            for j in range(trees_per_chunk):
+                if trees_trained >= n_estimators_total:
+                    break
+
+                print(f"Training tree {trees_trained + 1}/{n_estimators_total}...")
+                tree = train_tree(X_chunk, y_chunk, class_X, class_y, trees_trained)
+                new_estimators.append(tree)
+                trees_trained += 1
+                print_memory_usage()
+
+            # Free memory
+            del X_chunk, y_chunk
+            gc.collect()
+
+            # Save intermediate model whenever this chunk crossed a multiple of checkpoint_every
+            if trees_trained // args.checkpoint_every > trees_before_chunk // args.checkpoint_every:
+                save_checkpoint({
+                    "mode": "chunked",
+                    "model": assemble_forest(new_estimators, len(symptom_columns), len(le.classes_)),
+                    "trees_trained": trees_trained,
+                    "chunks_processed": chunks_processed,
+                    "chunk_size": chunk_size,
+                }, le, dataset, args.keep_checkpoints)
 
-# Check if file exists
-if not os.path.exists(symptoms_path):
-    print(f"Error: symptoms file not found at {symptoms_path}")
-    exit(1)
-
-# Load dataset in extremely memory-efficient way
-print("Loading dataset header first to determine structure...")
-df_sample = pd.read_csv(symptoms_path, nrows=5)
-total_columns = len(df_sample.columns)
-symptom_columns = df_sample.columns.drop("diseases")
-print(f"Dataset has {total_columns} columns including the target column")
-print_memory_usage()
-
-# Count lines without loading full dataset
-def count_lines(filepath):
-    count = 0
-    with open(filepath, 'r') as f:
-        for _ in f:
-            count += 1
-    return count - 1  # Subtract header
-
-total_rows = count_lines(symptoms_path)
-print(f"Total rows in dataset: {total_rows}")
-
-# Determine optimal chunk size based on available memory
-available_memory = psutil.virtual_memory().available / (1024 * 1024)  # in MB
-print(f"Available memory: {available_memory:.2f} MB")
-
-# Target using only 50% of available memory
-memory_target = available_memory * 0.5  
-estimated_row_size = 0.5  # MB per 1000 rows - adjust based on observations
-chunk_size = int((memory_target / estimated_row_size) * 1000)
-chunk_size = min(chunk_size, 10000)  # Cap at 10,000 rows per chunk
-print(f"Using chunk size of {chunk_size} rows")
-
-# Initialize label encoder
-le = LabelEncoder()
-all_labels = set()
-
-# First pass to collect all unique disease labels
-print("First pass: collecting unique disease labels...")
-for chunk in pd.read_csv(symptoms_path, chunksize=chunk_size):
-    all_labels.update(chunk["diseases"].unique())
-    print(f"\rCollected {len(all_labels)} unique labels so far...", end="")
-    sys.stdout.flush()
-
-print(f"\nFound {len(all_labels)} unique disease labels")
-print_memory_usage()
-
-# Fit the encoder with all labels
-print("Fitting label encoder...")
-le.fit(list(all_labels))
-print_memory_usage()
-
-# Train the model incrementally
-print("Training Random Forest model incrementally...")
-start_time = time.time()
-
-# Create a minimal initial model
-n_estimators_total = 200
-n_estimators_per_batch = 10
-trees_per_chunk = 2
-
-# Initialize base model with minimal trees
-print("Initializing base model...")
-base_model = RandomForestClassifier(n_estimators=1, random_state=42, 
-                                   class_weight="balanced", n_jobs=1)
-
-# For the first chunk, just create the model structure
-first_chunk = next(pd.read_csv(symptoms_path, chunksize=chunk_size))
-X_first = first_chunk[symptom_columns].values
-y_first = le.transform(first_chunk["diseases"].values)
-base_model.fit(X_first, y_first)
-
-# Delete the first chunk data to free memory
-del first_chunk, X_first, y_first
-gc.collect()
-print_memory_usage()
-
-# Clear the estimators to start fresh with our incremental approach
-base_estimators = base_model.estimators_
-base_model.estimators_ = []
-
-# Function to train a single tree
-def train_tree(X, y, tree_idx):
-    tree = RandomForestClassifier(n_estimators=1, random_state=42+tree_idx, 
-                                  bootstrap=True, class_weight="balanced")
-    tree.fit(X, y)
-    return tree.estimators_[0]
-
-# Incrementally train the model
-trees_trained = 0
-total_chunks = (total_rows + chunk_size - 1) // chunk_size
-chunks_processed = 0
-
-new_estimators = []
-while trees_trained < n_estimators_total:
-    print(f"\nTraining batch {trees_trained//trees_per_chunk + 1}/{n_estimators_total//trees_per_chunk}...")
-    
-    # Process each chunk
-    for i, chunk in enumerate(pd.read_csv(symptoms_path, chunksize=chunk_size)):
-        chunks_processed += 1
-        print(f"Processing chunk {chunks_processed}/{total_chunks}...")
-        
-        # Prepare data
-        X_chunk = chunk[symptom_columns].values
-        y_chunk = le.transform(chunk["diseases"].values)
-        
-        # Train trees for this chunk
-        for j in range(trees_per_chunk):
             if trees_trained >= n_estimators_total:
                 break
-                
-            print(f"Training tree {trees_trained + 1}/{n_estimators_total}...")
-            tree = train_tree(X_chunk, y_chunk, trees_trained)
-            new_estimators.append(tree)
-            trees_trained += 1
+
+        # If we've processed all chunks but still need more trees, start over
+        if trees_trained < n_estimators_total:
+            print("Restarting chunk processing to train more trees...")
+
+    print(f"\nModel training completed in {time.time() - start_time:.2f} seconds")
+
+    # Create the final model
+    final_model = assemble_forest(new_estimators, len(symptom_columns), len(le.classes_))
+
+    print(f"Final model has {len(final_model.estimators_)} trees")
+    print_memory_usage()
+
+    save_outputs(final_model, le, symptom_columns)
+    record_full_training(dataset, len(final_model.estimators_))
+    remove_checkpoints()
+
+# Bootstrap rows per tree that fit the memory budget (in MB) when n_jobs trees are fitted at once. Each worker
+# holds its bootstrap rows as uint8 plus sklearn's float32 copy.
+def bootstrap_samples(n_rows, n_features, memory_budget, n_jobs):
+    bytes_per_row = n_features * 5
+    unique_fraction = 1 - np.exp(-1)  # expected share of distinct rows in a bootstrap sample
+    budget_rows = int(memory_budget * 1024 * 1024 / n_jobs / bytes_per_row / unique_fraction)
+    return max(1, min(n_rows, budget_rows))
+
+# Fit one tree on a bootstrap sample drawn from the whole memory-mapped packed dataset.
+# Bootstrap multiplicities become sample weights, and one zero-weight row per class keeps every
+# tree's class axis identical to the label encoder's, so the trees average into a proper forest.
+# Only the first n_sample_rows rows (default: all) are sampled; any after them serve as class rows only.
+def fit_bootstrap_tree(bits, y, n_features, class_rows, tree_idx, max_samples, n_sample_rows=None):
+    rng = np.random.RandomState(42 + tree_idx)
+    sample = rng.randint(0, n_sample_rows or bits.shape[0], max_samples)
+    rows = np.union1d(sample, class_rows)
+    weights = np.bincount(sample, minlength=bits.shape[0])[rows].astype(np.float64)
+    X = np.unpackbits(bits[rows], axis=1, count=n_features)
+    tree = DecisionTreeClassifier(max_features="sqrt", class_weight="balanced",
+                                  random_state=rng.randint(np.iinfo(np.int32).max))
+    tree.fit(X, y[rows], sample_weight=weights)
+    return tree
+
+def train_memmap(args):
+    n_jobs, _, memory_budget = resource_limits()
+    print(f"Using {n_jobs} CPU cores for training")
+
+    dataset = load_dataset()
+    n_rows, n_features = dataset.n_rows, dataset.n_features
+    le = dataset.label_encoder()
+    y = np.asarray(dataset.labels)
+
+    save_symptom_index(dataset)
+    print_memory_usage()
+
+    max_samples = bootstrap_samples(n_rows, n_features, memory_budget, n_jobs)
+    print(f"Memory budget {memory_budget:.0f} MB: {max_samples} bootstrap samples per tree out of {n_rows} rows")
+
+    # First row of every class, added to each tree's sample with zero weight
+    class_rows = np.unique(y, return_index=True)[1]
+
+    # Tree seeds depend only on the tree index, so a resumed run continues exactly where it stopped
+    estimators = []
+    checkpoint = load_latest_checkpoint("memmap", le, dataset) if args.resume else None
+    if checkpoint is not None:
+        estimators = list(checkpoint["model"].estimators_)
+        max_samples = checkpoint["max_samples"]
+
+    print(f"Training {n_estimators_total - len(estimators)} trees in parallel on {effective_n_jobs(n_jobs)} workers...")
+    start_time = time.time()
+    batch_size = max(n_jobs * 2, 10)
+    with Parallel(n_jobs=n_jobs, backend="loky") as parallel:
+        for batch_start in range(len(estimators), n_estimators_total, batch_size):
+            batch_end = min(batch_start + batch_size, n_estimators_total)
+            estimators.extend(parallel(
+                delayed(fit_bootstrap_tree)(dataset.bits, y, n_features, class_rows, tree_idx, max_samples)
+                for tree_idx in range(batch_start, batch_end)
+            ))
+            print(f"Trained {len(estimators)}/{n_estimators_total} trees ({time.time() - start_time:.1f}s)")
             print_memory_usage()
-            
-        # Free memory
-        del X_chunk, y_chunk
-        gc.collect()
-        
-        # Save intermediate model every 20 trees as backup
-        if trees_trained % 20 == 0 and trees_trained > 0:
-            print(f"Saving intermediate model with {trees_trained} trees...")
-            temp_model = RandomForestClassifier(n_estimators=1, random_state=42)
-            temp_model.fit(np.zeros((1, len(symptom_columns))), np.zeros(1))
-            temp_model.estimators_ = new_estimators
-            temp_model.n_estimators = len(new_estimators)
-            
-            pickle.dump(temp_model, open(f"data/rf_model_temp_{trees_trained}trees.pkl", "wb"))
-            pickle.dump(le, open("data/label_encoder.pkl", "wb"))
-            pickle.dump(list(symptom_columns), open("data/symptom_columns.pkl", "wb"))
-            
-            print(f"Intermediate model saved with {trees_trained} trees")
-            
-        if trees_trained >= n_estimators_total:
-            break
-    
-    # If we've processed all chunks but still need more trees, start over
-    if trees_trained < n_estimators_total:
-        print("Restarting chunk processing to train more trees...")
-
-print(f"\nModel training completed in {time.time() - start_time:.2f} seconds")
-
-# Create the final model
-final_model = RandomForestClassifier(n_estimators=1, random_state=42)
-final_model.fit(np.zeros((1, len(symptom_columns))), np.zeros(1))
-final_model.estimators_ = new_estimators
-final_model.n_estimators = len(new_estimators)
-
-print(f"Final model has {len(final_model.estimators_)} trees")
-print_memory_usage()
-
-# Save model and encoder to pickle files
-print("Saving final model and data to pickle files...")
-pickle.dump(final_model, open("data/optimized_rf_model.pkl", "wb"))
-pickle.dump(le, open("data/label_encoder.pkl", "wb"))
-pickle.dump(list(symptom_columns), open("data/symptom_columns.pkl", "wb"))
-
-print("Model training and saving complete!")
-print_memory_usage()
+
+            # Checkpoint whenever this batch crossed a multiple of checkpoint_every
+            if batch_end // args.checkpoint_every > batch_start // args.checkpoint_every and batch_end < n_estimators_total:
+                save_checkpoint({
+                    "mode": "memmap",
+                    "model": assemble_forest(estimators, n_features, len(le.classes_)),
+                    "trees_trained": len(estimators),
+                    "max_samples": max_samples,
+                }, le, dataset, args.keep_checkpoints)
+
+    print(f"\nModel training completed in {time.time() - start_time:.2f} seconds")
+
+    final_model = assemble_forest(estimators, n_features, len(le.classes_))
+    print(f"Final model has {len(final_model.estimators_)} trees")
+    print_memory_usage()
+
+    save_outputs(final_model, le, dataset.columns)
+    record_full_training(dataset, len(final_model.estimators_))
+    remove_checkpoints()
+
+def read_new_rows(csv_offset, symptom_columns, chunk_size=10000):
+    # Packed feature bits and disease names of the complete rows after csv_offset, plus the offset they end at.
+    # A last line without its newline may still be being written and is left for the next run.
+    csv_columns = list(pd.read_csv(symptoms_path, nrows=0).columns)
+    if [column for column in csv_columns if column != label_column] != list(symptom_columns):
+        print("Error: the CSV's symptom columns differ from the saved model's; run a full training instead")
+        exit(1)
+    with open(symptoms_path, "rb") as f:
+        f.seek(csv_offset)
+        appended = f.read()
+    end_offset = csv_offset + appended.rfind(b"\n") + 1
+    bits, labels = [], []
+    if end_offset > csv_offset:
+        rows = io.BytesIO(appended[:end_offset - csv_offset])
+        for chunk in pd.read_csv(rows, header=None, names=csv_columns, chunksize=chunk_size):
+            features = chunk[symptom_columns].to_numpy(dtype=np.uint8)
+            if features.max(initial=0) > 1:
+                raise ValueError(f"Non-binary feature value in the rows appended to {symptoms_path}")
+            bits.append(np.packbits(features, axis=1))
+            labels.extend(chunk[label_column])
+    row_bytes = (len(symptom_columns) + 7) // 8
+    bits = np.concatenate(bits) if bits else np.zeros((0, row_bytes), dtype=np.uint8)
+    return bits, np.array(labels, dtype=object), end_offset
+
+def extend_label_encoder(le, new_labels):
+    # LabelEncoder needs sorted classes, so new diseases can shift existing codes: returns the extended
+    # encoder and, for every old code, its new one
+    classes = np.array(sorted(set(le.classes_) | set(new_labels)))
+    extended = LabelEncoder()
+    extended.classes_ = classes
+    return extended, np.searchsorted(classes, le.classes_)
+
+def remap_tree_classes(tree, old_to_new, n_classes):
+    # Rebuild the tree's node values with a class axis matching the extended encoder: column i moves to
+    # old_to_new[i] and new diseases get zero. The node structure is copied as is.
+    state = tree.tree_.__getstate__()
+    values = state["values"]
+    widened = np.zeros(values.shape[:2] + (n_classes,), dtype=values.dtype)
+    widened[:, :, old_to_new] = values
+    state["values"] = widened
+    tree.tree_ = Tree(tree.n_features_in_, np.array([n_classes], dtype=np.intp), tree.n_outputs_)
+    tree.tree_.__setstate__(state)
+    tree.classes_ = np.arange(n_classes)
+    tree.n_classes_ = n_classes
+    return tree
+
+def update_symptom_index(old_to_new, n_classes, bits, y, n_features):
+    # Move the saved symptom x class counts to the extended class axis and add the new rows' counts
+    index_path = os.path.join(data_dir, "symptom_disease_index.npz")
+    X = np.unpackbits(bits, axis=1, count=n_features)
+    one_hot = sparse.csr_matrix((np.ones(len(y)), (y, np.arange(len(y)))), shape=(n_classes, len(y)))
+    counts = sparse.csr_matrix((one_hot @ X).T)
+    if os.path.exists(index_path):
+        saved = sparse.load_npz(index_path).tocoo()
+        counts = counts + sparse.csr_matrix((saved.data, (saved.row, old_to_new[saved.col])), shape=(n_features, n_classes))
+    sparse.save_npz(index_path, sparse.csr_matrix(counts.astype(np.int32)))
+
+def train_incremental(args):
+    n_jobs, _, memory_budget = resource_limits()
+    print(f"Using {n_jobs} CPU cores for training")
+
+    if not os.path.exists(symptoms_path):
+        print(f"Error: symptoms file not found at {symptoms_path}")
+        exit(1)
+    manifest = load_manifest()
+    if manifest is None:
+        print("Error: no training manifest or packed dataset records which rows the model was trained on; "
+              "run a full training first")
+        exit(1)
+    csv_offset = manifest["csv_offset"]
+    csv_size = os.path.getsize(symptoms_path)
+    if csv_size < csv_offset or (manifest["csv_tail_sha256"] is not None and csv_tail_digest(csv_offset) != manifest["csv_tail_sha256"]):
+        print(f"Error: {symptoms_path} was rewritten since the last training, not appended to; run a full training instead")
+        exit(1)
+
+    # Load the existing forest and encoder
+    print("Loading the existing model...")
+    model = pickle.load(open(os.path.join(data_dir, "optimized_rf_model.pkl"), "rb"))
+    le = pickle.load(open(os.path.join(data_dir, "label_encoder.pkl"), "rb"))
+    symptom_columns = pickle.load(open(os.path.join(data_dir, "symptom_columns.pkl"), "rb"))
+    n_features = len(symptom_columns)
+    estimators = list(model.estimators_)
+    if any(tree.n_classes_ != len(le.classes_) for tree in estimators):
+        print("Error: incremental training needs every tree to predict the encoder's full class list; "
+              "retrain the model first")
+        exit(1)
+    print(f"Model has {len(estimators)} trees and {len(le.classes_)} disease labels")
+    print_memory_usage()
+
+    bits, labels, end_offset = read_new_rows(csv_offset, symptom_columns)
+    n_new_rows = len(labels)
+    if n_new_rows == 0:
+        print(f"No new rows in {symptoms_path} since the last training, nothing to do")
+        return
+    print(f"Read {n_new_rows} new rows after row {manifest['csv_rows']}")
+
+    start_time = time.time()
+    le, old_to_new = extend_label_encoder(le, labels)
+    n_classes = len(le.classes_)
+    new_classes = n_classes - len(old_to_new)
+    y = le.transform(labels).astype(np.int32)
+    if new_classes:
+        print(f"Adding {new_classes} new disease labels, remapping the existing trees' classes")
+        estimators = [remap_tree_classes(tree, old_to_new, n_classes) for tree in estimators]
+
+    # Classes absent from the new rows get an all-zero row each, so the new trees share the full class axis
+    missing = np.setdiff1d(np.arange(n_classes), y)
+    bits_with_classes = np.concatenate([bits, np.zeros((len(missing), bits.shape[1]), dtype=np.uint8)])
+    y_with_classes = np.concatenate([y, missing.astype(np.int32)])
+    class_rows = np.unique(y_with_classes, return_index=True)[1]
+
+    max_samples = bootstrap_samples(n_new_rows, n_features, memory_budget, n_jobs)
+
+    # Seeds continue from the trees trained so far, so new trees never repeat an earlier one's sample
+    first_tree = manifest["trees_trained"] if manifest["trees_trained"] is not None else len(estimators)
+    print(f"Training {args.new_trees} trees on the new rows, {max_samples} bootstrap samples each...")
+    new_estimators = Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(fit_bootstrap_tree)(bits_with_classes, y_with_classes, n_features, class_rows, tree_idx, max_samples, n_new_rows)
+        for tree_idx in range(first_tree, first_tree + args.new_trees)
+    )
+    estimators.extend(new_estimators)
+
+    # Retire the oldest trees beyond --max-trees, so the forest leans towards recent cases
+    retired = max(0, len(estimators) - args.max_trees) if args.max_trees else 0
+    if retired:
+        print(f"Retiring the {retired} oldest trees")
+        estimators = estimators[retired:]
+
+    print(f"\nIncremental training completed in {time.time() - start_time:.2f} seconds")
+    final_model = assemble_forest(estimators, n_features, n_classes)
+    print(f"Final model has {len(final_model.estimators_)} trees")
+    print_memory_usage()
+
+    update_symptom_index(old_to_new, n_classes, bits, y, n_features)
+    save_outputs(final_model, le, symptom_columns)
+    write_manifest(manifest["csv_rows"] + n_new_rows, end_offset, first_tree + args.new_trees, manifest["history"] + [{
+        "rows_added": n_new_rows,
+        "classes_added": new_classes,
+        "trees_added": args.new_trees,
+        "trees_retired": retired,
+        "seconds": round(time.time() - start_time, 2),
+        "finished_at": time.time(),
+    }])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the doctor recommendation Random Forest")
+    parser.add_argument("--mode", choices=["chunked", "memmap", "incremental"], default="chunked",
+                        help="chunked: fit trees one 10k-row chunk at a time (default); "
+                             "memmap: fit trees in parallel over the whole memory-mapped dataset; "
+                             "incremental: add trees fit on the rows appended to the CSV since the last run")
+    parser.add_argument("--trees", type=int, default=n_estimators_total, help="Number of trees to train")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the latest checkpoint in data/ instead of starting over")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="Trees between checkpoints")
+    parser.add_argument("--keep-checkpoints", type=int, default=2, help="Number of most recent checkpoints to keep")
+    parser.add_argument("--new-trees", type=int, default=20, help="Trees added by an incremental run")
+    parser.add_argument("--max-trees", type=int, default=None,
+                        help="After an incremental run, retire the oldest trees beyond this many (default: keep all)")
+    args = parser.parse_args()
+    n_estimators_total = args.trees
+
+    print("Starting ultra memory-efficient model training...")
+    print_memory_usage()
+
+    # Check if file exists; an already converted dataset is enough
+    if not os.path.exists(symptoms_path) and not os.path.exists(packed_prefix + ".json"):
+        print(f"Error: symptoms file not found at {symptoms_path}")
+        exit(1)
+
+    if args.mode == "incremental":
+        train_incremental(args)
+    elif args.mode == "memmap":
+        train_memmap(args)
+    else:
+        train_chunked(args)
+
+    print("Model training and saving complete!")
+    print_memory_usage()
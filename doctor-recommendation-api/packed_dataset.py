@@ -0,0 +1,142 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import LabelEncoder
+
+from flat_forest import source_signature
+
+# Bumped whenever the on-disk layout written by convert_csv changes
+PACKED_FORMAT_VERSION = 1
+
+
+def packed_paths(prefix):
+    return {
+        "bits": f"{prefix}.bits",
+        "labels": f"{prefix}.labels.npy",
+        "header": f"{prefix}.json",
+    }
+
+
+def convert_csv(csv_path, prefix, label_column="diseases", chunk_size=10000):
+    # Stream the 0/1 symptom CSV into three files: packed feature bits (one row of ceil(n_features / 8)
+    # bytes per case), int32 label codes, and a JSON header with the column names and label classes.
+    # Only one chunk is in memory at a time; labels get provisional ids in first-seen order and are
+    # remapped to sorted (LabelEncoder) order at the end.
+    paths = packed_paths(prefix)
+    if os.path.exists(paths["header"]):
+        os.remove(paths["header"])
+    columns = [column for column in pd.read_csv(csv_path, nrows=0).columns if column != label_column]
+    label_ids = {}
+    n_rows = 0
+
+    with open(paths["bits"] + ".tmp", "wb") as bits_file, open(paths["labels"] + ".tmp", "wb") as labels_file:
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+            features = chunk[columns].to_numpy(dtype=np.uint8)
+            if features.max(initial=0) > 1:
+                raise ValueError(f"Non-binary feature value in rows {n_rows}-{n_rows + len(chunk)} of {csv_path}")
+            bits_file.write(np.packbits(features, axis=1).tobytes())
+
+            codes = np.fromiter((label_ids.setdefault(label, len(label_ids)) for label in chunk[label_column]),
+                                dtype=np.int32, count=len(chunk))
+            labels_file.write(codes.tobytes())
+            n_rows += len(chunk)
+            print(f"\rConverted {n_rows} rows...", end="")
+            sys.stdout.flush()
+    print()
+
+    classes = sorted(label_ids)
+    remap = np.empty(len(label_ids), dtype=np.int32)
+    for new_code, label in enumerate(classes):
+        remap[label_ids[label]] = new_code
+    provisional = np.fromfile(paths["labels"] + ".tmp", dtype=np.int32)
+    np.save(paths["labels"], remap[provisional])
+    os.remove(paths["labels"] + ".tmp")
+    os.replace(paths["bits"] + ".tmp", paths["bits"])
+
+    # The header goes last, so a dataset with a header is always complete
+    with open(paths["header"], "w") as f:
+        json.dump({
+            "format_version": PACKED_FORMAT_VERSION,
+            "n_rows": n_rows,
+            "n_features": len(columns),
+            "row_bytes": (len(columns) + 7) // 8,
+            "columns": columns,
+            "classes": classes,
+            "source": source_signature(csv_path),
+        }, f)
+    return PackedDataset(prefix)
+
+
+def ensure_packed(csv_path, prefix):
+    # Reuse an existing conversion unless the CSV it came from has changed
+    header_path = packed_paths(prefix)["header"]
+    if os.path.exists(header_path):
+        with open(header_path) as f:
+            header = json.load(f)
+        if header.get("format_version") == PACKED_FORMAT_VERSION and (
+                not os.path.exists(csv_path) or header.get("source") == source_signature(csv_path)):
+            return PackedDataset(prefix)
+    print(f"Converting {csv_path} to packed dataset {prefix}...")
+    return convert_csv(csv_path, prefix)
+
+
+class PackedDataset:
+    # Read-only view of a converted dataset; bits and labels are memory-mapped, never parsed
+    def __init__(self, prefix):
+        paths = packed_paths(prefix)
+        with open(paths["header"]) as f:
+            header = json.load(f)
+        if header.get("format_version") != PACKED_FORMAT_VERSION:
+            raise ValueError(f"Unsupported packed dataset format {header.get('format_version')} in {prefix}")
+        self.prefix = prefix
+        self.columns = header["columns"]
+        self.classes = np.array(header["classes"])
+        self.n_rows = header["n_rows"]
+        self.n_features = header["n_features"]
+        # Modification time and size of the CSV this was converted from
+        self.source = header.get("source")
+        self.bits = np.memmap(paths["bits"], dtype=np.uint8, mode="r", shape=(self.n_rows, header["row_bytes"]))
+        self.labels = np.load(paths["labels"], mmap_mode="r")
+
+    def label_encoder(self):
+        le = LabelEncoder()
+        le.classes_ = self.classes
+        return le
+
+    def unpack(self, packed_rows):
+        return np.unpackbits(packed_rows, axis=1, count=self.n_features)
+
+    def rows(self, indices):
+        # Unpacked uint8 features for the given (preferably sorted) row indices
+        return self.unpack(self.bits[indices])
+
+    def iter_chunks(self, chunk_size=10000, start_chunk=0):
+        for start in range(start_chunk * chunk_size, self.n_rows, chunk_size):
+            stop = min(start + chunk_size, self.n_rows)
+            yield self.unpack(self.bits[start:stop]), np.asarray(self.labels[start:stop])
+
+    def class_symptom_counts(self, chunk_size=50000):
+        # (classes x features) count of cases of each class with each symptom
+        counts = np.zeros((len(self.classes), self.n_features), dtype=np.int64)
+        for X, y in self.iter_chunks(chunk_size):
+            one_hot = sparse.csr_matrix((np.ones(len(y)), (y, np.arange(len(y)))), shape=(len(self.classes), len(y)))
+            counts += (one_hot @ X).astype(np.int64)
+        return counts
+
+
+if __name__ == "__main__":
+    # Usage: python packed_dataset.py convert [dataset.csv] [output_prefix]
+    if len(sys.argv) < 2 or sys.argv[1] != "convert":
+        print("Usage: python packed_dataset.py convert [dataset.csv] [output_prefix]")
+        sys.exit(1)
+    data_dir = os.environ.get("DATA_DIR", "./data")
+    csv_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_dir, "Disease and symptoms dataset.csv")
+    prefix = sys.argv[3] if len(sys.argv) > 3 else os.path.join(data_dir, "symptom_dataset")
+    dataset = convert_csv(csv_path, prefix)
+    packed_size = os.path.getsize(packed_paths(prefix)["bits"]) + os.path.getsize(packed_paths(prefix)["labels"])
+    print(f"Packed {dataset.n_rows} rows x {dataset.n_features} features, {len(dataset.classes)} classes: "
+          f"{os.path.getsize(csv_path) / 1e6:.1f} MB CSV -> {packed_size / 1e6:.1f} MB")
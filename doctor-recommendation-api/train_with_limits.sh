@@ -1,11 +1,17 @@
 #!/bin/bash
 
 # Script to train the model with extreme resource limitations
-# Usage: ./train_with_limits.sh [max_memory_mb] [max_cpu_percent]
+# Usage: ./train_with_limits.sh [max_memory_mb] [max_cpu_percent] [training options...]
+# Example: ./train_with_limits.sh 4096 30 --mode memmap
 
 # Default values
 MAX_MEMORY=${1:-4096}  # Default to 4GB max memory
 MAX_CPU=${2:-30}       # Default to 30% max CPU
+TRAIN_ARGS="${@:3}"    # Extra options passed to optimized_train_model.py
+
+# Let the training script size its worker pool and samples to the same limits
+export TRAIN_MAX_MEMORY_MB=${MAX_MEMORY}
+export TRAIN_MAX_CPU_PERCENT=${MAX_CPU}
 
 echo "Starting model training with strict limits:"
 echo "- Maximum memory: ${MAX_MEMORY}MB"
@@ -15,16 +21,20 @@ echo "- Maximum CPU: ${MAX_CPU}%"
 if command -v systemd-run &> /dev/null; then
     echo "Using systemd-run to limit resources..."
     systemd-run --user --scope -p MemoryMax=${MAX_MEMORY}M -p CPUQuota=${MAX_CPU}% \
-        python optimized_train_model.py
+        python optimized_train_model.py ${TRAIN_ARGS}
 elif command -v docker &> /dev/null; then
     echo "Using Docker to limit resources..."
     docker run --rm \
         --cpus="$(echo "scale=2; ${MAX_CPU}/100*$(nproc)" | bc)" \
         --memory="${MAX_MEMORY}m" \
+        -e TRAIN_MAX_MEMORY_MB -e TRAIN_MAX_CPU_PERCENT \
         -v "$(pwd)/data:/app/data" \
         -v "$(pwd)/optimized_train_model.py:/app/optimized_train_model.py" \
+        -v "$(pwd)/packed_dataset.py:/app/packed_dataset.py" \
+        -v "$(pwd)/flat_forest.py:/app/flat_forest.py" \
+        -w /app \
         python:3.9-slim \
-        bash -c "pip install scikit-learn pandas numpy joblib psutil && python /app/optimized_train_model.py"
+        bash -c "pip install scikit-learn pandas numpy scipy joblib psutil && python /app/optimized_train_model.py ${TRAIN_ARGS}"
 else
     echo "Training with cgroups memory limits..."
     # Create temporary cgroup
@@ -37,13 +47,13 @@ else
         sudo cgset -r cpu.cfs_quota_us=$(($(cat /sys/fs/cgroup/cpu/cpu.cfs_period_us) * $MAX_CPU / 100)) $CGROUP_NAME
         
         # Run in cgroup
-        sudo cgexec -g memory,cpu:$CGROUP_NAME python optimized_train_model.py
+        sudo --preserve-env=TRAIN_MAX_MEMORY_MB,TRAIN_MAX_CPU_PERCENT cgexec -g memory,cpu:$CGROUP_NAME python optimized_train_model.py ${TRAIN_ARGS}
         
         # Clean up
         sudo cgdelete memory,cpu:$CGROUP_NAME
     else
         echo "No resource limiting tools available, using built-in Python limits only..."
-        python optimized_train_model.py
+        python optimized_train_model.py ${TRAIN_ARGS}
     fi
 fi
 